@@ -0,0 +1,312 @@
+import os
+import re
+import ast
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+import posixpath
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# ⚙️ Сборка архива с проектом
+ARTIFACT_MAX_FILES = int(os.getenv("ARTIFACT_MAX_FILES", "300"))
+ARTIFACT_MAX_FILE_BYTES = int(os.getenv("ARTIFACT_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+ARTIFACT_MAX_TOTAL_BYTES = int(os.getenv("ARTIFACT_MAX_TOTAL_BYTES", str(40 * 1024 * 1024)))  # до сжатия
+ARTIFACT_MAX_ZIP_BYTES = int(os.getenv("ARTIFACT_MAX_ZIP_BYTES", str(45 * 1024 * 1024)))  # лимит Bot API — 50 МБ
+ARTIFACT_SPOOL_THRESHOLD = int(os.getenv("ARTIFACT_SPOOL_THRESHOLD", str(1024 * 1024)))  # больше — пишем на диск
+ARTIFACT_CACHE_SIZE = int(os.getenv("ARTIFACT_CACHE_SIZE", "32"))  # готовых архивов для повторной отправки
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_WORKERS", "2"))
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "")  # пусто — системный каталог временных файлов
+
+# Имя модуля в import → пакет в requirements.txt, где они различаются
+PACKAGE_NAMES = {
+    "bs4": "beautifulsoup4", "PIL": "pillow", "yaml": "pyyaml", "cv2": "opencv-python",
+    "sklearn": "scikit-learn", "dotenv": "python-dotenv", "telegram": "python-telegram-bot",
+    "dateutil": "python-dateutil", "docx": "python-docx", "fitz": "pymupdf", "Crypto": "pycryptodome",
+}
+
+
+class ArtifactTooLarge(Exception):
+    pass
+
+
+# 🗂 Проект: относительный путь → содержимое
+class Project:
+    def __init__(self, name, files, description=""):
+        self.name = name
+        self.files = files
+        self.description = description
+
+    def digest(self) -> str:
+        h = hashlib.sha256(self.name.encode("utf-8"))
+        for path in sorted(self.files):
+            content = self.files[path]
+            h.update(b"\0" + path.encode("utf-8") + b"\0")
+            h.update(content if isinstance(content, bytes) else content.encode("utf-8"))
+        return h.hexdigest()
+
+    def total_bytes(self) -> int:
+        return sum(len(c if isinstance(c, bytes) else c.encode("utf-8")) for c in self.files.values())
+
+
+def safe_path(path: str):
+    path = path.strip().strip("`*'\"").replace("\\", "/")
+    path = posixpath.normpath(path).lstrip("/")
+    if not path or path == "." or path.startswith("..") or ":" in path or len(path) > 200:
+        return None
+    return path
+
+
+def slugify(name: str) -> str:
+    slug = re.sub(r"[^\w\-]+", "_", name.strip(), flags=re.UNICODE).strip("_")
+    return slug[:60] or "tool"
+
+
+# Заголовок с именем файла перед блоком кода: "### src/app.py", "**app.py**", "`app.py`:", "Файл: app.py"
+_HEADING = re.compile(r"^\s*(?:#{1,6}\s*|\*\*|`|(?:файл|file)\s*:?\s*)*([\w./\\-]+\.[\w]+|Dockerfile|Makefile)\W*$",
+                      re.IGNORECASE)
+_FENCE = re.compile(r"^```([^\n`]*)\n(.*?)^```", re.MULTILINE | re.DOTALL)
+_EXTENSIONS = {"python": "py", "py": "py", "bash": "sh", "sh": "sh", "json": "json", "yaml": "yml", "yml": "yml",
+               "toml": "toml", "html": "html", "javascript": "js", "js": "js", "css": "css", "sql": "sql",
+               "markdown": "md", "md": "md", "text": "txt", "txt": "txt", "dockerfile": "Dockerfile"}
+
+
+def _files_from_json(data):
+    files = data.get("files") if isinstance(data, dict) else None
+    if isinstance(files, dict):
+        return {str(k): str(v) for k, v in files.items()}
+    if isinstance(files, list):
+        return {str(f.get("path") or f.get("name")): str(f.get("content", ""))
+                for f in files if isinstance(f, dict) and (f.get("path") or f.get("name"))}
+    return {}
+
+
+def _files_from_markdown(text):
+    files = {}
+    unnamed = 0
+    for match in _FENCE.finditer(text):
+        info, body = match.group(1).strip(), match.group(2)
+        words = info.split()
+        path = None
+        # ```python src/app.py или ```src/app.py
+        for word in reversed(words):
+            if "." in word or word in ("Dockerfile", "Makefile"):
+                path = word.split("=", 1)[-1]
+                break
+        if path is None:
+            lines = text[:match.start()].rstrip("\n").rsplit("\n", 1)
+            heading = _HEADING.match(lines[-1]) if lines else None
+            path = heading.group(1) if heading else None
+        if path is None:
+            language = words[0].lower() if words else "txt"
+            extension = _EXTENSIONS.get(language, "txt")
+            unnamed += 1
+            path = extension if extension == "Dockerfile" else (
+                f"main.{extension}" if unnamed == 1 else f"part_{unnamed}.{extension}")
+        files[path] = body
+    return files
+
+
+# 🧩 Вывод модели в режиме кода → файлы проекта (JSON с files, markdown с блоками кода или просто код)
+def parse_project(output, name="tool", description="") -> Project:
+    files = {}
+    if isinstance(output, dict):
+        files = _files_from_json(output) or _files_from_json(output.get("params") or {})
+        description = description or output.get("reply") or output.get("task") or ""
+        output = ""
+    else:
+        stripped = output.strip()
+        if stripped.startswith("{"):
+            try:
+                files = _files_from_json(json.loads(stripped))
+            except ValueError:
+                pass
+        if not files:
+            files = _files_from_markdown(output)
+    if not files and output.strip():
+        files = {"main.py": output.strip() + "\n"}
+
+    clean = {}
+    for path, content in files.items():
+        path = safe_path(path)
+        if path is None:
+            continue
+        clean[path] = content if content.endswith("\n") else content + "\n"
+
+    if clean and "requirements.txt" not in clean:
+        requirements = infer_requirements(clean)
+        if requirements:
+            clean["requirements.txt"] = "\n".join(requirements) + "\n"
+    if clean and not any(p.lower() == "readme.md" for p in clean):
+        clean["README.md"] = _readme(name, description, clean)
+    return Project(name, clean, description)
+
+
+def infer_requirements(files) -> list:
+    local = {posixpath.splitext(posixpath.basename(p))[0] for p in files} | {p.split("/")[0] for p in files}
+    modules = set()
+    for path, content in files.items():
+        if not path.endswith(".py"):
+            continue
+        try:
+            tree = ast.parse(content)
+        except SyntaxError:
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules.add(node.module.split(".")[0])
+    external = modules - set(sys.stdlib_module_names) - local
+    return sorted(PACKAGE_NAMES.get(m, m) for m in external)
+
+
+def _readme(name, description, files):
+    lines = [f"# {name}", ""]
+    if description:
+        lines += [description, ""]
+    lines += ["## Файлы", ""] + [f"- `{p}`" for p in sorted(files)] + [""]
+    if "requirements.txt" in files:
+        lines += ["## Установка", "", "    pip install -r requirements.txt", ""]
+    entry = next((p for p in ("main.py", "app.py", "bot.py") if p in files), None)
+    if entry:
+        lines += ["## Запуск", "", f"    python {entry}", ""]
+    return "\n".join(lines)
+
+
+# 📦 Готовый архив: маленький — в памяти, большой — во временном файле
+class Artifact:
+    def __init__(self, digest, filename, size, files, data=None, path=None):
+        self.digest = digest
+        self.filename = filename
+        self.size = size
+        self.files = files
+        self.data = data
+        self.path = path
+        self.file_id = None  # после первой отправки Telegram отдаёт file_id — повторно не загружаем
+
+    # Новый поток для каждой отправки: один архив можно слать нескольким чатам одновременно
+    def open(self):
+        if self.data is not None:
+            return BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def discard(self):
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _write_zip(project, target):
+    with ZipFile(target, "w", compression=ZIP_DEFLATED, compresslevel=6) as archive:
+        root = slugify(project.name)
+        for path in sorted(project.files):
+            archive.writestr(f"{root}/{path}", project.files[path])
+
+
+# 🏗 Сборка в пуле потоков, проверка лимитов, повторное использование по хэшу содержимого
+class ArtifactBuilder:
+    def __init__(self, cache_size=ARTIFACT_CACHE_SIZE, spool_threshold=ARTIFACT_SPOOL_THRESHOLD,
+                 workers=ARTIFACT_WORKERS, directory=ARTIFACT_DIR):
+        self.cache_size = cache_size
+        self.spool_threshold = spool_threshold
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artifacts")
+        self.directory = directory  # создаётся при первом большом архиве
+        self._cache = OrderedDict()
+        self._building = {}  # digest -> future: одинаковые проекты одновременно собираются один раз
+        self.stats = {"built": 0, "reused": 0, "spooled": 0, "rejected": 0}
+
+    def check_limits(self, project):
+        if not project.files:
+            raise ArtifactTooLarge("в ответе модели нет файлов")
+        if len(project.files) > ARTIFACT_MAX_FILES:
+            raise ArtifactTooLarge(f"слишком много файлов: {len(project.files)} (максимум {ARTIFACT_MAX_FILES})")
+        for path, content in project.files.items():
+            if len(content) > ARTIFACT_MAX_FILE_BYTES:
+                raise ArtifactTooLarge(f"файл {path} больше {ARTIFACT_MAX_FILE_BYTES // 1024} КБ")
+        if project.total_bytes() > ARTIFACT_MAX_TOTAL_BYTES:
+            raise ArtifactTooLarge(f"проект больше {ARTIFACT_MAX_TOTAL_BYTES // (1024 * 1024)} МБ")
+
+    # Разбор тоже в пуле: ast.parse большого проекта заметно занимает поток
+    async def parse(self, output, name="tool", description="") -> Project:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, parse_project, output, name, description)
+
+    async def build(self, project) -> Artifact:
+        try:
+            self.check_limits(project)
+        except ArtifactTooLarge:
+            self.stats["rejected"] += 1
+            raise
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(self.executor, project.digest)  # sha256 мегабайтов — тоже не на loop
+        artifact = self._cache.get(digest)
+        if artifact is not None:
+            self._cache.move_to_end(digest)
+            self.stats["reused"] += 1
+            return artifact
+        if digest in self._building:
+            self.stats["reused"] += 1
+            return await asyncio.shield(self._building[digest])
+
+        future = loop.run_in_executor(self.executor, self._build_sync, project, digest)
+        self._building[digest] = future
+        try:
+            artifact = await asyncio.shield(future)
+        except ArtifactTooLarge:
+            self.stats["rejected"] += 1
+            raise
+        finally:
+            self._building.pop(digest, None)
+        self._remember(artifact)
+        return artifact
+
+    # Выполняется в потоке: event loop не блокируется сжатием
+    def _build_sync(self, project, digest) -> Artifact:
+        filename = f"{slugify(project.name)}.zip"
+        if project.total_bytes() <= self.spool_threshold:
+            buffer = BytesIO()
+            _write_zip(project, buffer)
+            data = buffer.getvalue()
+            artifact = Artifact(digest, filename, len(data), len(project.files), data=data)
+        else:
+            path = os.path.join(self._spool_dir(), f"{digest[:32]}.zip")
+            with open(path + ".part", "wb") as target:
+                _write_zip(project, target)
+            os.replace(path + ".part", path)
+            self.stats["spooled"] += 1
+            artifact = Artifact(digest, filename, os.path.getsize(path), len(project.files), path=path)
+        if artifact.size > ARTIFACT_MAX_ZIP_BYTES:
+            artifact.discard()
+            raise ArtifactTooLarge(f"архив {artifact.size // (1024 * 1024)} МБ больше лимита Telegram")
+        self.stats["built"] += 1
+        logging.info(f"[ArtifactBuilder] 📦 Архив {filename}: {artifact.files} файлов, {artifact.size} байт"
+                     f"{' (на диске)' if artifact.path else ''}")
+        return artifact
+
+    def _spool_dir(self):
+        if not self.directory:
+            self.directory = tempfile.mkdtemp(prefix="toolbot-artifacts-")
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def _remember(self, artifact):
+        self._cache[artifact.digest] = artifact
+        while len(self._cache) > self.cache_size:
+            _, old = self._cache.popitem(last=False)
+            old.discard()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for artifact in self._cache.values():
+            artifact.discard()
+        self._cache.clear()
+
+
+artifact_builder = ArtifactBuilder()
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tracemalloc
+from io import BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# Запуск: python bench/bench_artifacts.py [файлов] [КБ на файл]
+# Сборка архива большого проекта: BytesIO на event loop против artifacts.py (пул потоков, диск, кэш)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artifacts import ArtifactBuilder, Project
+
+
+def make_project(files, kb):
+    rng = random.Random(7)
+    words = ["user", "price", "item", "parse", "fetch", "result", "config", "retry", "cache", "report"]
+    content = {}
+    for i in range(files):
+        lines = []
+        while sum(len(line) for line in lines) < kb * 1024:
+            name = "_".join(rng.choice(words) for _ in range(3))
+            lines.append(f"def {name}_{rng.randint(0, 10 ** 6)}(value):\n    return value * {rng.random():.6f}\n\n")
+        content[f"pkg_{i % 20}/module_{i}.py"] = "".join(lines)
+    return Project("Большой проект", content, "Сгенерированный проект для бенчмарка")
+
+
+def legacy_zip(project):
+    buffer = BytesIO()
+    with ZipFile(buffer, "w", compression=ZIP_DEFLATED, compresslevel=6) as archive:
+        for path, text in project.files.items():
+            archive.writestr(path, text)
+    buffer.seek(0)
+    return buffer
+
+
+async def measure(build):
+    # Тикер каждые 5 мс: максимальная задержка — сколько loop был занят
+    lag = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal lag
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - started - 0.005)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)  # тикер успевает запуститься
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = await build()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    running = False
+    await tick
+    return result, elapsed, lag, peak
+
+
+async def run(files, kb):
+    project = make_project(files, kb)
+    print(f"project: {len(project.files)} files, {project.total_bytes() / 1e6:.1f} MB")
+
+    async def legacy():
+        return legacy_zip(project)
+
+    _, elapsed, lag, peak = await measure(legacy)
+    print(f"BytesIO on loop     build={elapsed:6.2f} s  max loop lag={lag * 1000:7.1f} ms  peak={peak / 1e6:6.1f} MB")
+
+    builder = ArtifactBuilder(cache_size=4)
+    try:
+        artifact, elapsed, lag, peak = await measure(lambda: builder.build(project))
+        print(f"ArtifactBuilder     build={elapsed:6.2f} s  max loop lag={lag * 1000:7.1f} ms  peak={peak / 1e6:6.1f} MB  "
+              f"zip={artifact.size / 1e6:.1f} MB {'on disk' if artifact.path else 'in memory'}")
+        _, elapsed, lag, peak = await measure(lambda: builder.build(project))
+        print(f"resend (same hash)  build={elapsed * 1000:6.2f} ms  stats={builder.stats}")
+    finally:
+        builder.close()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(run(*(args + [250, 64][len(args):])))
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+# Запуск: python bench/bench_http_pool.py [кол-во запросов] [параллельность]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ["LLM_CACHE_ENABLED"] = "0"  # иначе "after" мерил бы кэш ответов, а не пул соединений
+
+import httpx
+from bench.fake_openrouter import FakeOpenRouter
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<28} mean={statistics.mean(samples) * 1000:7.2f} ms  "
+          f"p50={statistics.median(samples) * 1000:7.2f} ms  p95={p95 * 1000:7.2f} ms")
+
+
+async def run(requests, concurrency):
+    fake = FakeOpenRouter()
+    url = await fake.start()
+    os.environ["OPENROUTER_URL"] = url
+
+    import main
+    main.OPENROUTER_URL = url
+    payload = {"model": "google/gemma-3-27b-it", "messages": [{"role": "user", "content": "бот для парсинга"}]}
+    sem = asyncio.Semaphore(concurrency)
+
+    # ⬅️ До: новый AsyncClient на каждый вызов (как было в analyze_message)
+    async def per_call():
+        async with sem:
+            started = time.perf_counter()
+            async with httpx.AsyncClient() as client:
+                response = await client.post(url, json=payload)
+                response.raise_for_status()
+            return time.perf_counter() - started
+
+    # ➡️ После: analyze_message через общий пул
+    async def pooled():
+        async with sem:
+            started = time.perf_counter()
+            await main.analyze_message("бот для парсинга", main.prompt_chat)
+            return time.perf_counter() - started
+
+    main.init_http_client()
+    try:
+        await pooled()  # прогрев пула
+        before = await asyncio.gather(*[per_call() for _ in range(requests)])
+        after = await asyncio.gather(*[pooled() for _ in range(requests)])
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+
+    print(f"requests={requests} concurrency={concurrency}")
+    report("client per call (before)", before)
+    report("shared pool (after)", after)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    c = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(run(n, c))
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+# Запуск: python bench/bench_intents.py [кол-во сообщений] [доля коротких реплик]
+# Сколько запросов к модели экономит локальный разбор намерений и во что обходится сам разбор
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("TG_GLOBAL_RATE", "1000000")  # лимиты Telegram меряет bench_outbox.py
+os.environ.setdefault("TG_CHAT_RATE", "1000000")
+os.environ["LLM_STREAMING"] = "0"
+os.environ["COALESCE_DELAY"] = "0"
+
+from bench.fake_openrouter import FakeOpenRouter
+
+TRIVIAL = ["привет", "Спасибо!", "спасибо большое", "не знаю", "предложи идеи", "заново", "Здравствуйте"]
+REAL = ["нужен бот для парсинга цен с маркетплейса", "хочу скрипт, который переименует фото по дате",
+        "привет, сделай конвертер pdf в текст", "предложи идеи для анализа логов nginx"]
+
+
+class FakeMessage:
+    def __init__(self, user_id, text):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+
+    async def answer(self, text, **kwargs):
+        return self
+
+    async def reply(self, text, **kwargs):
+        return self
+
+
+async def run(messages, share):
+    import main
+    from intents import intent_router
+    fake = FakeOpenRouter(latency=0.05)
+    main.OPENROUTER_URL = await fake.start()
+    rng = random.Random(1)
+    texts = [rng.choice(TRIVIAL) if rng.random() < share else rng.choice(REAL) for _ in range(messages)]
+
+    try:
+        await main.analyze_message(main.SUGGESTION_PROMPT, main.prompt_chat, mode="chat", refresh_cache=True)
+        before = fake.calls
+        started = time.perf_counter()
+        # Каждое сообщение — от нового пользователя: считаем запросы, а не ход диалога
+        await asyncio.gather(*[main.handle_message(FakeMessage(i, text)) for i, text in enumerate(texts)])
+        elapsed = time.perf_counter() - started
+        calls = fake.calls - before
+        print(f"{messages} messages ({share:.0%} trivial) in {elapsed:.2f} s")
+        print(f"LLM calls: {calls}, avoided: {intent_router.stats['llm_calls_avoided']} "
+              f"({intent_router.stats['llm_calls_avoided'] / messages:.0%})")
+        print(f"by intent: { {k: v for k, v in intent_router.stats.items() if k != 'llm_calls_avoided'} }")
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+
+    started = time.perf_counter()
+    for text in texts * 20:
+        intent_router.classify(text)
+    per_message = (time.perf_counter() - started) / (len(texts) * 20)
+    print(f"classify: {per_message * 1e6:.1f} µs/message")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    asyncio.run(run(count, share))
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+from collections import defaultdict
+
+# Запуск: python bench/bench_json.py [повторов]
+# Сколько ответов модели из корпуса (bench/json_corpus.jsonl) удаётся разобрать: старый extract_json
+# (от первой '{' до последней '}') против ReplyParser, целиком и по кусочкам, как при стриминге
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_json import ReplyParser, parse_reply, parse_stats
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_corpus.jsonl")
+
+
+def legacy_extract(text):
+    start = text.find("{")
+    end = text.rfind("}") + 1
+    if start == -1 or end == 0:
+        return None
+    try:
+        return json.loads(text[start:end])
+    except ValueError:
+        return None
+
+
+def streamed(text, chunk=8):
+    parser = ReplyParser()
+    for i in range(0, len(text), chunk):
+        parser.feed(text[i:i + chunk])
+    return parser.finish()
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(repeats):
+    corpus = load_corpus()
+    methods = {"extract_json": legacy_extract, "ReplyParser": parse_reply, "ReplyParser stream": streamed}
+    table = defaultdict(lambda: defaultdict(int))  # kind → метод → удачных разборов
+    counts = defaultdict(int)
+    for row in corpus:
+        counts[row["kind"]] += 1
+        for name, method in methods.items():
+            result = method(row["text"])
+            if row["reply"] is not None:
+                ok = isinstance(result, dict) and result.get("reply") == row["reply"]
+            else:
+                ok = isinstance(result, dict) and bool(result.get("status"))  # оборванный ответ: есть хотя бы статус
+            table[row["kind"]][name] += ok
+
+    print(f"{len(corpus)} responses; parsed correctly (reply matches):")
+    print(f"{'kind':<16}{'n':>4}" + "".join(f"{name:>20}" for name in methods))
+    for kind in counts:
+        print(f"{kind:<16}{counts[kind]:>4}" + "".join(f"{table[kind][name]:>20}" for name in methods))
+    with_json = [row for row in corpus if row["kind"] != "no_json"]
+    for name in methods:
+        ok = sum(table[kind][name] for kind in counts if kind != "no_json")
+        print(f"{name}: {ok}/{len(with_json)} ({ok / len(with_json):.0%}) of responses with JSON")
+
+    for name, method in methods.items():
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for row in corpus:
+                method(row["text"])
+        per_response = (time.perf_counter() - started) / (repeats * len(corpus))
+        print(f"{name}: {per_response * 1e6:.1f} µs/response")
+    print(f"parse stats: {parse_stats}")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
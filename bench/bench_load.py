@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+# Запуск: python bench/bench_load.py --users 500 --turns 3 [--min-rate 100 --max-p95 1.5 --max-lag 0.1]
+# Нагрузочный тест: апдейты тысяч пользователей идут через настоящие хэндлеры dp (webhook-путь),
+# модель и Telegram — локальные заглушки. С порогами скрипт завершается с кодом 1 — офлайн-проверка регрессий
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("COALESCE_DELAY", "0")
+os.environ.setdefault("LLM_CACHE_PREWARM", "0")
+BENCH_DIR = None
+if "SESSION_DB_PATH" not in os.environ:
+    BENCH_DIR = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ["SESSION_DB_PATH"] = os.path.join(BENCH_DIR, "sessions.db")
+
+from bench.fake_openrouter import FakeOpenRouter, SHAPES
+from bench.fake_telegram import FakeTelegram
+
+TEXTS = ["нужен бот для парсинга цен с маркетплейса", "хочу скрипт, который переименует фото по дате",
+         "сделай конвертер pdf в текст", "нужна выгрузка заказов в excel раз в день",
+         "предложи идеи для анализа логов nginx", "результат в csv, запуск по расписанию"]
+TRIVIAL = ["привет", "спасибо", "заново"]
+REPLY_TIMEOUT = 30  # секунд без ответа — считаем сообщение потерянным
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Заглушки живут в своём потоке и event loop: их работа не попадает в задержку loop бота
+class ServerThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="bench-fakes", daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+# Ожидание ответа бота в чат: заглушка Telegram сообщает о каждом новом сообщении
+class Replies:
+    def __init__(self, loop):
+        self.loop = loop
+        self.waiters = {}
+
+    def expect(self, chat_id) -> asyncio.Future:
+        future = self.waiters[chat_id] = self.loop.create_future()
+        return future
+
+    def on_reply(self, chat_id, method):  # вызывается из потока заглушек
+        self.loop.call_soon_threadsafe(self._resolve, chat_id, time.perf_counter())
+
+    def _resolve(self, chat_id, at):
+        future = self.waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(at)
+
+
+def make_update(update_id, kind, user_id, text) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": user, "text": text}
+    if kind == "callback":
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": text, "message": message}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+class Load:
+    def __init__(self, args):
+        self.args = args
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.latency = defaultdict(list)  # вид апдейта → секунды до первого ответа
+        self.unanswered = 0
+        self.lag = []
+
+    # 🧑 Пользователь: /start → кнопка → несколько реплик; следующую пишет, только получив ответ
+    async def user(self, main, types, replies, user_id):
+        steps = [("start", "/start"), ("callback", "make_tool")]
+        for _ in range(self.args.turns):
+            trivial = random.random() < self.args.trivial
+            steps.append(("text", random.choice(TRIVIAL if trivial else TEXTS)))
+
+        await asyncio.sleep(random.uniform(0, self.args.think))  # пользователи приходят не разом
+        for kind, text in steps:
+            reply = replies.expect(user_id)
+            started = time.perf_counter()
+            task = main.updates.submit(types.Update(**make_update(next(self.update_ids), kind, user_id, text)))
+            try:
+                answered = await asyncio.wait_for(reply, REPLY_TIMEOUT)
+                self.latency[kind].append(answered - started)
+            except asyncio.TimeoutError:
+                self.unanswered += 1
+            await task
+            if self.args.think:
+                await asyncio.sleep(random.expovariate(1 / self.args.think))
+
+    # ⏱ Задержка event loop: насколько позже срабатывает таймер на 10 мс
+    async def monitor_lag(self, interval=0.01):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag.append(time.perf_counter() - started - interval)
+
+    async def run(self, main, types, replies):
+        monitor = asyncio.create_task(self.monitor_lag())
+        started = time.perf_counter()
+        await asyncio.gather(*[self.user(main, types, replies, 10 ** 6 + i) for i in range(self.args.users)])
+        elapsed = time.perf_counter() - started
+        monitor.cancel()
+        return elapsed
+
+
+def report(load, elapsed, main, fake_llm, fake_tg, rss_growth) -> dict:
+    samples = sorted(s for kind_samples in load.latency.values() for s in kind_samples)
+    updates = len(samples) + load.unanswered
+    lag = sorted(load.lag)
+    sessions = len(main.sessions)
+    result = {
+        "rate": updates / elapsed,
+        "p50": percentile(samples, 0.5), "p95": percentile(samples, 0.95), "p99": percentile(samples, 0.99),
+        "lag_p99": percentile(lag, 0.99), "lag_max": lag[-1] if lag else 0.0,
+        "unanswered": load.unanswered,
+    }
+    print(f"{load.args.users} users, {updates} updates in {elapsed:.1f} s: {result['rate']:.0f} msg/s")
+    print(f"first reply: p50 {result['p50'] * 1000:.0f} ms, p95 {result['p95'] * 1000:.0f} ms, "
+          f"p99 {result['p99'] * 1000:.0f} ms, unanswered {load.unanswered}")
+    for kind, kind_samples in sorted(load.latency.items()):
+        kind_samples.sort()
+        print(f"  {kind:<8} n={len(kind_samples):<6} p50 {percentile(kind_samples, 0.5) * 1000:.0f} ms, "
+              f"p95 {percentile(kind_samples, 0.95) * 1000:.0f} ms")
+    print(f"event loop lag: p99 {result['lag_p99'] * 1000:.1f} ms, max {result['lag_max'] * 1000:.1f} ms")
+    per_session = main.sessions.stats()["approx_bytes_per_session"]
+    print(f"sessions: {sessions}, ~{per_session / 1024:.1f} KB/session (estimate), "
+          f"RSS +{rss_growth / 2 ** 20:.1f} MB ({rss_growth / max(sessions, 1) / 1024:.1f} KB/session)")
+    print(f"OpenRouter calls: {fake_llm.calls}, avoided: {main.intent_router.stats['llm_calls_avoided']}, "
+          f"JSON parse: {main.parse_stats}")
+    print(f"Telegram calls: {dict(fake_tg.calls)}, errors: {dict(fake_tg.errors)}, outbox: {main.outbox.stats}")
+    return result
+
+
+# 🚦 Пороги регрессии: нарушение любого — код выхода 1
+def check(result, args) -> list:
+    failures = []
+    if args.min_rate is not None and result["rate"] < args.min_rate:
+        failures.append(f"throughput {result['rate']:.0f} msg/s < {args.min_rate}")
+    if args.max_p95 is not None and result["p95"] > args.max_p95:
+        failures.append(f"p95 {result['p95']:.3f} s > {args.max_p95}")
+    if args.max_p99 is not None and result["p99"] > args.max_p99:
+        failures.append(f"p99 {result['p99']:.3f} s > {args.max_p99}")
+    if args.max_lag is not None and result["lag_p99"] > args.max_lag:
+        failures.append(f"event loop lag p99 {result['lag_p99']:.3f} s > {args.max_lag}")
+    if result["unanswered"] > args.max_unanswered:
+        failures.append(f"unanswered {result['unanswered']} > {args.max_unanswered}")
+    return failures
+
+
+async def run(args):
+    fakes = ServerThread()
+    fake_llm = FakeOpenRouter(latency=args.llm_latency, jitter=args.llm_latency / 2, error_rate=args.llm_errors,
+                              content=[SHAPES[name] for name in args.shapes.split(",")])
+    fake_tg = FakeTelegram(latency=args.tg_latency, jitter=args.tg_latency / 2,
+                           flood_limit=30 if args.telegram_limits else None)
+    replies = Replies(asyncio.get_running_loop())
+    fake_tg.on_reply = replies.on_reply
+    os.environ["OPENROUTER_URL"] = fakes.run(fake_llm.start())
+    os.environ["TELEGRAM_API_URL"] = fakes.run(fake_tg.start())
+
+    import main
+    from aiogram import types
+    await main.start_services()
+    rss_before = rss_bytes()  # после импорта: прирост — это сессии, очереди и буферы под нагрузкой
+    try:
+        load = Load(args)
+        elapsed = await load.run(main, types, replies)
+        await main.updates.drain()
+        await main.outbox.drain()
+        result = report(load, elapsed, main, fake_llm, fake_tg, rss_bytes() - rss_before)
+    finally:
+        await main.stop_services()
+        fakes.run(fake_llm.stop())
+        fakes.run(fake_tg.stop())
+        fakes.close()
+        if BENCH_DIR:
+            shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    return check(result, args)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=3, help="реплик пользователя после /start и кнопки")
+    parser.add_argument("--think", type=float, default=0.5, help="средняя пауза пользователя между репликами, с")
+    parser.add_argument("--trivial", type=float, default=0.2, help="доля коротких реплик («привет», «спасибо»)")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-errors", type=float, default=0.0, help="доля ответов 502 от OpenRouter")
+    parser.add_argument("--shapes", default="questions,ideas,ready,prose", help=f"из {', '.join(SHAPES)}")
+    parser.add_argument("--tg-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="настоящие лимиты Telegram: outbox по умолчанию и 429 сверх 30 сообщений/с")
+    parser.add_argument("--min-rate", type=float)
+    parser.add_argument("--max-p95", type=float)
+    parser.add_argument("--max-p99", type=float)
+    parser.add_argument("--max-lag", type=float)
+    parser.add_argument("--max-unanswered", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import logging
+    args = parse_args()
+    if not args.telegram_limits:
+        os.environ.setdefault("TG_GLOBAL_RATE", "1000000")  # лимиты Telegram меряет bench_outbox.py
+        os.environ.setdefault("TG_CHAT_RATE", "1000000")
+    logging.disable(logging.CRITICAL)
+    failures = asyncio.run(run(args))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+import timeit
+from types import SimpleNamespace
+
+# Запуск: python bench/bench_logging.py [кол-во сообщений]
+# Сколько времени event loop тратит на логи: вывод в самом loop против очереди и потока вывода
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("TG_GLOBAL_RATE", "1000000")  # лимиты Telegram меряет bench_outbox.py
+os.environ.setdefault("TG_CHAT_RATE", "1000000")
+os.environ["LLM_STREAMING"] = "0"
+os.environ["LLM_CACHE_ENABLED"] = "0"
+os.environ["COALESCE_DELAY"] = "0"
+os.environ["SESSION_DB_PATH"] = ""
+
+from bench.fake_openrouter import FakeOpenRouter
+
+HISTORY = "нужен бот, который следит за ценами на маркетплейсе и присылает уведомления. " * 40
+
+
+class FakeMessage:
+    def __init__(self, user_id, text):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+
+    async def answer(self, text, **kwargs):
+        return self
+
+
+def sync_logging(level, stream):
+    import logs
+    logs.shutdown_logging()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logs.JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def queue_logging(level, stream):
+    import logs
+    logs.shutdown_logging()
+    logs.setup_logging(level=level, stream=stream)
+
+
+async def drive(main, messages, users):
+    # Поток event loop: его процессорное время — то, что логи отнимают у обработки сообщений
+    cpu = time.thread_time()
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        main.handle_message(FakeMessage(i % users, f"сообщение {i}: {HISTORY[:200 + i % 800]}"))
+        for i in range(messages)
+    ])
+    return time.perf_counter() - started, time.thread_time() - cpu
+
+
+async def run(messages):
+    import main
+    import logs
+    fake = FakeOpenRouter(latency=0.01)
+    main.OPENROUTER_URL = await fake.start()
+    out = tempfile.NamedTemporaryFile("w", suffix=".log", delete=False)
+    users = max(1, messages // 5)
+
+    try:
+        for name, configure, level in (("sync INFO", sync_logging, "INFO"), ("queue INFO", queue_logging, "INFO"),
+                                       ("sync DEBUG", sync_logging, "DEBUG"), ("queue DEBUG", queue_logging, "DEBUG")):
+            configure(level, out)
+            for logger in ("httpx", "httpcore", "aiohttp.access"):
+                logging.getLogger(logger).setLevel(logging.WARNING)
+            main.sessions = main.SessionStore(context_factory=main.new_context)
+            await drive(main, 100, users)  # прогрев
+            elapsed, loop_cpu = await drive(main, messages, users)
+            logs.shutdown_logging()
+            print(f"{name:<12} wall={elapsed:6.2f} s  loop CPU={loop_cpu * 1000:8.1f} ms  "
+                  f"per message={loop_cpu / messages * 1e6:6.0f} µs")
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+        out.close()
+        os.unlink(out.name)
+
+    # Отладочная запись при выключенном DEBUG: f-строка против ленивых полей
+    logging.getLogger().setLevel(logging.INFO)
+    text = HISTORY * 5
+    eager = timeit.timeit(lambda: logging.debug(f"[analyze_message] 🧠 Содержимое content:\n{text}"), number=20000)
+    lazy = timeit.timeit(lambda: logging.debug("[analyze_message] 🧠 Содержимое content",
+                                               extra=logs.fields(payload=text)), number=20000)
+    print(f"disabled debug call: f-string {eager / 20000 * 1e6:.2f} µs, lazy {lazy / 20000 * 1e6:.2f} µs")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import asyncio
+import statistics
+from types import SimpleNamespace
+
+# Запуск: python bench/bench_outbox.py [ответов модели] [коротких подтверждений] [чатов]
+# Всплеск ответов: отправка прямо из хэндлеров против очереди outbox.py под лимитами Telegram
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.utils.exceptions import RetryAfter
+
+from outbox import Outbox, TokenBucket, TG_MESSAGE_LIMIT, PRIORITY_NORMAL
+
+LONG_REPLY = "Вот план инструмента: парсер, планировщик, уведомления. " * 90  # ~5000 символов
+
+
+# Заглушка Bot API: не больше 30 сообщений за любую секунду и 1 в секунду (запас 3) на чат
+class FakeTelegram:
+    def __init__(self):
+        self.recent = []
+        self.chats = {}
+        self.sent = 0
+        self.flood_errors = 0
+        self.too_long = 0
+
+    async def send(self, chat_id, text):
+        await asyncio.sleep(0.005)  # сеть
+        now = time.monotonic()
+        self.recent = [t for t in self.recent if now - t < 1.0]
+        bucket = self.chats.setdefault(chat_id, TokenBucket(1, 3))
+        if len(self.recent) >= 30 or bucket.wait_time() > 0:
+            self.flood_errors += 1
+            raise RetryAfter(1)
+        if len(text) > TG_MESSAGE_LIMIT:
+            self.too_long += 1
+            raise ValueError("message is too long")
+        self.recent.append(now)
+        bucket.take()
+        self.sent += 1
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+
+class FakeMessage:
+    def __init__(self, telegram, chat_id):
+        self.telegram = telegram
+        self.chat = SimpleNamespace(id=chat_id)
+
+    async def answer(self, text, **kwargs):
+        return await self.telegram.send(self.chat.id, text)
+
+
+def workload(telegram, replies, acks, chats):
+    jobs = [(FakeMessage(telegram, i % chats), LONG_REPLY if i % 10 == 0 else "Готово! " * 40, False)
+            for i in range(replies)]
+    # Подтверждения приходят в другие чаты через секунду после всплеска
+    jobs += [(FakeMessage(telegram, chats + i), "🚀 Отлично!", True) for i in range(acks)]
+    return jobs
+
+
+async def inline(replies, acks, chats):
+    telegram = FakeTelegram()
+    started = time.monotonic()
+
+    async def one(message, text):
+        try:
+            await message.answer(text)
+        except Exception:
+            pass
+
+    await asyncio.gather(*[one(m, t) for m, t, _ in workload(telegram, replies, acks, chats)])
+    return telegram, time.monotonic() - started, [], []
+
+
+async def queued(replies, acks, chats, ack_lane=True):
+    telegram = FakeTelegram()
+    outbox = Outbox()
+    started = time.monotonic()
+    latency = {True: [], False: []}
+
+    async def one(message, text, ack):
+        if ack:
+            await asyncio.sleep(1)
+        sent_at = time.monotonic()
+        await outbox.answer(message, text, priority=None if ack_lane else PRIORITY_NORMAL)
+        latency[ack].append(time.monotonic() - sent_at)
+
+    await asyncio.gather(*[one(m, t, ack) for m, t, ack in workload(telegram, replies, acks, chats)])
+    return telegram, time.monotonic() - started, latency[True], latency[False]
+
+
+async def run(replies, acks, chats):
+    modes = (("inline", inline), ("outbox, one lane", lambda *a: queued(*a, ack_lane=False)), ("outbox", queued))
+    for name, mode in modes:
+        telegram, elapsed, ack_latency, reply_latency = await mode(replies, acks, chats)
+        print(f"{name:<17} delivered={telegram.sent:4d}  flood errors={telegram.flood_errors:4d}  "
+              f"too long={telegram.too_long:3d}  {elapsed:5.1f} s  {telegram.sent / elapsed:5.1f} msg/s")
+        if ack_latency:
+            print(f"{'':<17} ack p50={statistics.median(ack_latency):.2f} s  "
+                  f"reply p50={statistics.median(reply_latency):.2f} s")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(run(*(args + [200, 50, 120][len(args):])))
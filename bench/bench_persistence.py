@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+# Запуск: python bench/bench_persistence.py [кол-во сообщений] [пользователей] [раундов]
+# Задержка handle_message без хранения на диске и с SQLite (отложенная запись). Варианты чередуются
+# несколько раундов (шум машины одинаково ложится на оба), итог — медианы по раундам
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("TG_GLOBAL_RATE", "1000000")  # лимиты Telegram меряет bench_outbox.py
+os.environ.setdefault("TG_CHAT_RATE", "1000000")
+os.environ["LLM_STREAMING"] = "0"
+os.environ["LLM_CACHE_ENABLED"] = "0"
+os.environ["COALESCE_DELAY"] = "0"
+
+from bench.fake_openrouter import FakeOpenRouter
+
+
+class FakeMessage:
+    def __init__(self, user_id, text):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+
+    async def answer(self, text, **kwargs):
+        return self
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+# ⏱ Задержка event loop: насколько позже срабатывает таймер на 10 мс
+async def monitor_lag(lag, interval=0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag.append(time.perf_counter() - started - interval)
+
+
+async def drive(main, messages, users, concurrency=50):
+    sem = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i):
+        async with sem:
+            started = time.perf_counter()
+            await main.handle_message(FakeMessage(i % users, f"сообщение {i}: нужен бот для парсинга цен"))
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(messages)])
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return messages / elapsed, samples
+
+
+async def run(messages, users, rounds):
+    import main
+    from session_backend import SessionBackend, SQLiteSessionBackend
+    fake = FakeOpenRouter()
+    main.OPENROUTER_URL = await fake.start()
+    db_path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    variants = {"memory only": SessionBackend, "sqlite write-behind": lambda: SQLiteSessionBackend(db_path)}
+    results = {name: [] for name in variants}
+
+    try:
+        for _ in range(rounds):
+            for name, factory in variants.items():
+                backend = factory()
+                main.sessions = main.SessionStore(context_factory=main.new_context, backend=backend)
+                await backend.start()
+                await drive(main, 200, users)  # прогрев
+                lag = []
+                monitor = asyncio.create_task(monitor_lag(lag))
+                rate, samples = await drive(main, messages, users)
+                monitor.cancel()
+                await main.sessions.close()
+                lag.sort()
+                results[name].append((rate, statistics.median(samples), percentile(samples, 0.99),
+                                      percentile(lag, 0.99), lag[-1]))
+                if isinstance(backend, SQLiteSessionBackend):
+                    writes, flushes = backend.writes, backend.flushes
+
+        print(f"median of {rounds} rounds:")
+        for name, rows in results.items():
+            rate, p50, p99, lag99, lag_max = (statistics.median(column) for column in zip(*rows))
+            print(f"{name:<22} {rate:8.0f} msg/s  p50={p50 * 1000:6.2f} ms  p99={p99 * 1000:6.2f} ms  "
+                  f"loop lag p99={lag99 * 1000:5.1f} ms max={lag_max * 1000:5.1f} ms")
+        print(f"{'':<22} {writes} session writes in {flushes} batches (last round)")
+
+        # «Перезапуск»: новая память, сессии подтягиваются с диска при первом сообщении
+        backend = SQLiteSessionBackend(db_path)
+        main.sessions = main.SessionStore(context_factory=main.new_context, backend=backend)
+        await backend.start()
+        session = await main.sessions.load(0)
+        print(f"after restart: user 0 restored with {len(session.context)} turns, mode={session.mode}")
+        await main.sessions.close()
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    u = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    r = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    asyncio.run(run(n, u, r))
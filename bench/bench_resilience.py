@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import asyncio
+
+# Запуск: python bench/bench_resilience.py
+# Ошибки, хвостовые задержки и недоступная модель — против локальной заглушки OpenRouter
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ["LLM_CACHE_ENABLED"] = "0"
+os.environ["LLM_BACKOFF_BASE"] = "0.05"
+os.environ["LLM_HEDGE_MIN_DELAY"] = "0.05"
+
+from bench.fake_openrouter import FakeOpenRouter
+
+REQUESTS = 200
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def drive(main, resilience, concurrency=20):
+    main.openrouter_resilience = resilience
+    sem = asyncio.Semaphore(concurrency)
+    latencies, failed = [], 0
+
+    async def one(i):
+        nonlocal failed
+        async with sem:
+            started = time.perf_counter()
+            result = await main.analyze_message(f"запрос {i}", main.prompt_chat)
+            latencies.append(time.perf_counter() - started)
+            if "task" not in result:
+                failed += 1
+
+    await asyncio.gather(*[one(i) for i in range(REQUESTS)])
+    return latencies, failed
+
+
+def report(name, latencies, failed, resilience):
+    stats = resilience.snapshot()
+    print(f"  {name:<26} ok={REQUESTS - failed:3d}/{REQUESTS}  p50={pct(latencies, 0.5) * 1000:6.0f} ms  "
+          f"p99={pct(latencies, 0.99) * 1000:6.0f} ms  retries={stats['retries']} hedges={stats['hedges']} "
+          f"fallbacks={stats['fallbacks']} short_circuits={stats['short_circuits']}")
+
+
+async def run():
+    import main
+    from resilience import ResilientLLM
+
+    scenarios = [
+        ("20% 503 errors", dict(latency=0.02, error_rate=0.2, error_status=503), [
+            ("single attempt", ResilientLLM(fallback_models=[], max_retries=0)),
+            ("retries + jittered backoff", ResilientLLM(fallback_models=[], max_retries=2)),
+        ]),
+        ("10% 429 with Retry-After: 0.1", dict(latency=0.02, error_rate=0.1, error_status=429, retry_after=0.1), [
+            ("single attempt", ResilientLLM(fallback_models=[], max_retries=0)),
+            ("retries honoring Retry-After", ResilientLLM(fallback_models=[], max_retries=2)),
+        ]),
+        ("3% of responses +1.5 s", dict(latency=0.03, slow_rate=0.03, slow_latency=1.5), [
+            ("no hedging", ResilientLLM(fallback_models=[], hedging=False)),
+            ("hedged after p95", ResilientLLM(fallback_models=[], hedging=True)),
+        ]),
+        ("primary model down", dict(latency=0.02, down_models={"google/gemma-3-27b-it"}), [
+            ("no fallback", ResilientLLM(fallback_models=[], max_retries=1)),
+            ("fallback + breaker", ResilientLLM(fallback_models=["google/gemma-3-12b-it"], max_retries=1)),
+        ]),
+    ]
+    for title, fake_options, variants in scenarios:
+        print(title)
+        fake = FakeOpenRouter(**fake_options)
+        main.OPENROUTER_URL = await fake.start()
+        try:
+            for name, resilience in variants:
+                if resilience.hedging:
+                    # Прогрев: копим замеры задержек для порога p95, счётчики обнуляем
+                    await drive(main, resilience)
+                    resilience.stats = dict.fromkeys(resilience.stats, 0)
+                latencies, failed = await drive(main, resilience)
+                report(name, latencies, failed, resilience)
+        finally:
+            await fake.stop()
+    await main.close_http_client()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import asyncio
+
+# Запуск: python bench/bench_scheduler.py
+# Нагрузочный тест планировщика против локальной заглушки OpenRouter:
+# один «тяжёлый» пользователь шлёт сотни запросов, десятки обычных — по несколько.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ["LLM_CACHE_ENABLED"] = "0"
+
+from bench.fake_openrouter import FakeOpenRouter
+
+HEAVY_REQUESTS = 300
+LIGHT_USERS = 40
+LIGHT_REQUESTS = 3
+CONCURRENCY = 8
+LATENCY = 0.05
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def scenario(main, scheduler, fair):
+    main.llm_scheduler = scheduler
+    heavy, light, busy = [], [], 0
+
+    async def request(user_id, bucket, delay=0.0):
+        nonlocal busy
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        # Без честной очереди все пользователи для планировщика неотличимы (чистый FIFO)
+        result = await main.analyze_message(f"запрос {user_id}", main.prompt_chat, user_id=user_id if fair else None)
+        if result["reply"] == main.BUSY_REPLY:
+            busy += 1
+        else:
+            bucket.append(time.perf_counter() - started)
+
+    tasks = [request(0, heavy) for _ in range(HEAVY_REQUESTS)]
+    # Обычные пользователи приходят чуть позже, когда очередь уже забита тяжёлым
+    tasks += [request(u, light, 0.05 + u * 0.01) for u in range(1, LIGHT_USERS + 1) for _ in range(LIGHT_REQUESTS)]
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return heavy, light, busy, elapsed
+
+
+def report(name, heavy, light, busy, elapsed, scheduler):
+    snap = scheduler.snapshot()
+    print(f"{name}  total={elapsed:.2f} s  busy replies={busy}  queue wait p95={snap['wait_p95'] * 1000:.0f} ms")
+    if light:
+        print(f"    light users: p50={pct(light, 0.5) * 1000:6.0f} ms  p95={pct(light, 0.95) * 1000:6.0f} ms  "
+              f"max={max(light) * 1000:6.0f} ms  (served {len(light)})")
+    if heavy:
+        print(f"    heavy user:  p50={pct(heavy, 0.5) * 1000:6.0f} ms  p95={pct(heavy, 0.95) * 1000:6.0f} ms  "
+              f"(served {len(heavy)})")
+
+
+async def run():
+    import main
+    from llm_scheduler import LLMScheduler
+    fake = FakeOpenRouter(latency=LATENCY)
+    main.OPENROUTER_URL = await fake.start()
+    try:
+        for name, fair, scheduler in (
+            ("FIFO, cap only        ", False, LLMScheduler(CONCURRENCY, max_queue=10_000, max_per_user=0)),
+            ("fair per-user queueing", True, LLMScheduler(CONCURRENCY, max_queue=10_000, max_per_user=0)),
+            ("fair + backpressure   ", True, LLMScheduler(CONCURRENCY, max_queue=100, max_per_user=3)),
+        ):
+            heavy, light, busy, elapsed = await scenario(main, scheduler, fair)
+            report(name, heavy, light, busy, elapsed, scheduler)
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run())
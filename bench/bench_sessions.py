@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import tracemalloc
+
+# Запуск: python bench/bench_sessions.py [кол-во пользователей]
+# Память хранилища сессий и стоимость очистки при сотнях тысяч пользователей
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import ConversationContext
+from session_store import SessionStore
+
+
+def run(users):
+    store = SessionStore(context_factory=ConversationContext, ttl=3600)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for user_id in range(users):
+        session = store.get_or_create(user_id)
+        session.context.add("user", "бот для парсинга цен с сайтов")
+        session.context.add("assistant", "Расскажи подробнее, какие сайты?")
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(f"users={users}  traced={used / 1024 / 1024:.1f} MiB  ({used / users:.0f} B/session)")
+    print(f"store.stats() estimate: {store.stats()['approx_bytes_per_session']} B/session")
+    started = time.perf_counter()
+    store.stats()  # его вызывают цикл очистки и /metrics: не должен зависеть от числа сессий
+    print(f"store.stats(): {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    # Половина пользователей «проснулась», остальные истекают
+    now = time.time()
+    for user_id in range(0, users, 2):
+        store.get(user_id).last_active = now + 1800
+    started = time.perf_counter()
+    removed = store.expire(now + 3601)
+    print(f"expire(): removed={len(removed)} in {(time.perf_counter() - started) * 1000:.1f} ms, "
+          f"left={len(store)}")
+    started = time.perf_counter()
+    store.expire(now + 3602)
+    print(f"expire() with nothing due: {(time.perf_counter() - started) * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
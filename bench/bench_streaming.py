@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+# Запуск: python bench/bench_streaming.py
+# Сравнивает время до первого видимого текста: обычный запрос vs стриминг с правками сообщения
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("TG_GLOBAL_RATE", "1000000")  # лимиты Telegram меряет bench_outbox.py
+os.environ.setdefault("TG_CHAT_RATE", "1000000")
+os.environ["LLM_CACHE_ENABLED"] = "0"  # второй одинаковый запрос иначе придёт из кэша
+
+from bench.fake_openrouter import FakeOpenRouter
+
+LONG_REPLY = json.dumps({
+    "status": "need_more_info",
+    "reply": "Звучит интересно! " * 40,
+    "params": {"вопросы": ["Откуда брать данные?", "Куда сохранять результат?"]},
+}, ensure_ascii=False)
+
+
+class FakeMessage:
+    def __init__(self, delay=0.0):
+        self.delay = delay  # задержка Telegram на каждый вызов
+        self.chat = SimpleNamespace(id=1)
+        self.started = time.monotonic()
+        self.first_visible = None
+        self.edits = 0
+
+    async def answer(self, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        if self.first_visible is None:
+            self.first_visible = time.monotonic() - self.started
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.edits += 1
+        return self
+
+
+async def run():
+    # ~600 символов по 8 за 20 мс ≈ 1.5 с генерации
+    fake = FakeOpenRouter(latency=0.3, content=LONG_REPLY, chunk_size=8, chunk_delay=0.02)
+    url = await fake.start()
+    import main
+    import streaming
+    main.OPENROUTER_URL = url
+    streaming.STREAM_EDIT_INTERVAL = 0.25
+
+    try:
+        plain = FakeMessage()
+        result = await main.analyze_message("бот для парсинга", main.prompt_chat)
+        await plain.answer(result["reply"])
+
+        streamed = FakeMessage()
+        progress = streaming.ProgressiveReply(streamed, interval=0.25)
+        result = await main.analyze_message("бот для парсинга", main.prompt_chat, on_delta=progress.update)
+        await progress.finalize(result["reply"])
+
+        # Telegram отвечает по 1.5 с: правки не должны растягивать чтение стрима
+        slow = FakeMessage(delay=1.5)
+        progress = streaming.ProgressiveReply(slow, interval=0.25)
+        started = time.monotonic()
+        await main.analyze_message("бот для парсинга", main.prompt_chat, on_delta=progress.update)
+        slow_generation = time.monotonic() - started
+        await progress.finalize(result["reply"])
+    finally:
+        await main.close_http_client()
+        await fake.stop()
+
+    print(f"non-streaming: first visible text after {plain.first_visible:.2f} s")
+    print(f"streaming:     first visible text after {streamed.first_visible:.2f} s "
+          f"({streamed.edits} edits, status={result['status']})")
+    print(f"slow Telegram (1.5 s/call): model response read in {slow_generation:.2f} s ({slow.edits} edits)")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+
+# Запуск: python bench/bench_workers.py [кол-во пользователей] [воркеров]
+# Насколько ровно кольцо делит пользователей, сколько их переезжает при уходе воркера
+# и сколько бот не принимает апдейты, пока кольцо перестраивается после падения воркера
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOOLBOT_TOKEN", "123456:bench")
+os.environ.setdefault("LLM_CACHE_PREWARM", "0")
+os.environ.setdefault("WORKER_HEARTBEAT", "0.2")
+os.environ.setdefault("WORKER_TIMEOUT", "1")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")  # воркеры настраивают логи сами
+BENCH_DIR = None
+if "WORKER_DB_PATH" not in os.environ:  # воркеры импортируют этот файл заново и берут пути из окружения
+    BENCH_DIR = tempfile.mkdtemp(prefix="bench_workers_")
+    os.environ["WORKER_DB_PATH"] = os.path.join(BENCH_DIR, "workers.db")
+    os.environ["SESSION_DB_PATH"] = os.path.join(BENCH_DIR, "sessions.db")
+
+from workers import HashRing
+
+
+def ring_stats(users, count):
+    ring = HashRing(range(count))
+    owners = {user: ring.node(user) for user in range(users)}
+    loads = [0] * count
+    for node in owners.values():
+        loads[node] += 1
+    print(f"{users} users on {count} workers: min {min(loads)}, max {max(loads)}, "
+          f"max/mean {max(loads) / (users / count):.2f}")
+
+    smaller = HashRing(range(1, count))
+    moved = sum(owners[user] != smaller.node(user) for user in range(users))
+    moved_modulo = sum(user % count != user % (count - 1) for user in range(users))
+    print(f"worker 0 leaves: moved {moved / users:.0%} of users "
+          f"(its own share {loads[0] / users:.0%}; hash modulo would move {moved_modulo / users:.0%})")
+
+    started = time.perf_counter()
+    for user in range(users):
+        ring.node(user)
+    print(f"lookup: {(time.perf_counter() - started) / users * 1e6:.1f} µs/update")
+
+
+async def failover(count):
+    import main
+    from workers import Router
+
+    router = Router(main.run_worker, count)
+    started = time.perf_counter()
+    await router.start()
+    while len(router.ring.nodes) < count:
+        await asyncio.sleep(0.01)
+    print(f"{count} workers spawned and in the ring after {time.perf_counter() - started:.2f} s")
+
+    router.processes[0].kill()
+    killed = time.perf_counter()
+    while router.stats["restarts"] == 0 or len(router.ring.nodes) < count:
+        await asyncio.sleep(0.01)
+    print(f"worker killed: back to {count} workers after {time.perf_counter() - killed:.2f} s, "
+          f"rebalances: {router.stats['rebalances'] - 1}")
+    await router.stop()
+    if BENCH_DIR:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    ring_stats(users, count)
+    asyncio.run(failover(count))
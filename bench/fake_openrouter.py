@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+from aiohttp import web
+
+# 🧪 Локальная заглушка OpenRouter /chat/completions для бенчмарков
+
+DEFAULT_CONTENT = json.dumps({
+    "status": "need_more_info",
+    "reply": "Расскажи подробнее, что должен делать инструмент?",
+    "task": "",
+    "params": {"вопросы": ["Какие входные данные?", "Какой формат результата?"]},
+}, ensure_ascii=False)
+
+# Разные формы ответа модели: content может быть списком, тогда форма выбирается случайно на каждый запрос
+SHAPES = {
+    "questions": DEFAULT_CONTENT,
+    "ideas": json.dumps({
+        "status": "need_more_info",
+        "reply": "Вот что можно сделать:",
+        "task": "",
+        "params": {"вопросы": [{"название": "Парсер цен", "описание": "Собирает цены с сайтов в CSV"},
+                               {"название": "Сортировщик фото", "описание": "Раскладывает фото по датам"}]},
+    }, ensure_ascii=False),
+    "ready": json.dumps({
+        "status": "ready_to_start_code_phase",
+        "reply": "Понял задачу: бот для парсинга цен.",
+        "task": "Бот для парсинга цен",
+        "params": {},
+    }, ensure_ascii=False),
+    "prose": "Конечно! Вот ответ:\n```json\n" + DEFAULT_CONTENT + "\n```\nЕсли нужно, уточню.",
+    "broken": DEFAULT_CONTENT[:len(DEFAULT_CONTENT) // 2],
+}
+
+
+class FakeOpenRouter:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, content=DEFAULT_CONTENT,
+                 chunk_size=8, chunk_delay=0.0, error_status=502, retry_after=None,
+                 slow_rate=0.0, slow_latency=0.0, down_models=()):
+        self.latency = latency
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate  # доля «хвостовых» медленных ответов
+        self.slow_latency = slow_latency
+        self.down_models = set(down_models)  # эти модели всегда отвечают 503
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.content = content
+        self.calls = 0
+        self.runner = None
+        self.url = None
+
+    async def _delay(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.slow_rate and random.random() < self.slow_rate:
+            delay += self.slow_latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def chat_completions(self, request: web.Request):
+        self.calls += 1
+        body = await request.json()
+        await self._delay()
+        if body.get("model") in self.down_models:
+            return web.json_response({"error": {"message": "model unavailable"}}, status=503)
+        if self.error_rate and random.random() < self.error_rate:
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return web.json_response({"error": {"message": "fake upstream error"}},
+                                     status=self.error_status, headers=headers)
+        content = random.choice(self.content) if isinstance(self.content, list) else self.content
+        if body.get("stream"):
+            return await self._stream(request, content)
+        if self.chunk_delay:
+            # Без стрима клиент ждёт всю генерацию целиком
+            chunks = -(-len(content) // self.chunk_size)
+            await asyncio.sleep(self.chunk_delay * chunks)
+        return web.json_response({
+            "id": f"fake-{self.calls}",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30},
+        })
+
+    # 📡 SSE-ответ в формате OpenRouter: content режется на кусочки
+    async def _stream(self, request, content):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for i in range(0, len(content), self.chunk_size):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + self.chunk_size]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        usage = {"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}}
+        await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", self.chat_completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/api/v1/chat/completions"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,91 @@
+import time
+import random
+import asyncio
+from collections import Counter, deque
+from aiohttp import web
+
+# 🧪 Локальная заглушка Telegram Bot API для бенчмарков: бот подключается через TELEGRAM_API_URL
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, flood_limit=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate  # доля ответов 500
+        self.flood_limit = flood_limit  # сообщений в секунду на бота, сверх — 429 как у Telegram
+        self.calls = Counter()  # по методам
+        self.errors = Counter()  # 429 и 500
+        self.on_reply = None  # on_reply(chat_id, method) — новое сообщение в чат (не правка)
+        self._sent = deque()  # моменты отправки за последнюю секунду
+        self._message_id = 0
+        self.runner = None
+        self.url = None
+
+    def _message(self, chat_id, **extra):
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, **extra}
+
+    def _flooded(self) -> bool:
+        if not self.flood_limit:
+            return False
+        now = time.monotonic()
+        while self._sent and self._sent[0] <= now - 1:
+            self._sent.popleft()
+        if len(self._sent) >= self.flood_limit:
+            return True
+        self._sent.append(now)
+        return False
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        data = await request.post()
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors[500] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"})
+
+        chat_id = int(data["chat_id"]) if "chat_id" in data else None
+        if method in ("sendmessage", "senddocument", "editmessagetext") and self._flooded():
+            self.errors[429] += 1
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}})
+
+        if method == "sendmessage":
+            result = self._message(chat_id, text=data.get("text", ""))
+        elif method == "senddocument":
+            document = data.get("document")
+            name = getattr(document, "filename", None) or "file"
+            result = self._message(chat_id, caption=data.get("caption"), document={
+                "file_id": f"file-{self._message_id + 1}", "file_unique_id": f"u{self._message_id + 1}",
+                "file_name": name})
+        elif method == "editmessagetext":
+            result = self._message(chat_id, text=data.get("text", ""))
+            result["message_id"] = int(data.get("message_id", 0))
+        elif method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "ToolBot", "username": "fake_tool_bot"}
+        else:
+            result = True  # deleteMessage, answerCallbackQuery, sendChatAction, setWebhook...
+
+        if method in ("sendmessage", "senddocument") and self.on_reply is not None:
+            self.on_reply(chat_id, method)
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
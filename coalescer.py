@@ -0,0 +1,124 @@
+import os
+import asyncio
+import logging
+
+from logs import fields
+
+# ⚙️ Сколько ждать следующее сообщение пользователя, прежде чем звать модель (секунды)
+COALESCE_DELAY = float(os.getenv("COALESCE_DELAY", "0.6"))
+
+
+class _UserState:
+    __slots__ = ("messages", "timer", "task", "done", "respond")
+
+    def __init__(self):
+        self.messages = []  # сообщения, ещё не ушедшие в модель
+        self.timer = None   # отложенный запуск (debounce)
+        self.task = None    # текущий запрос к модели
+        self.done = None    # future: ответ на текущую пачку отправлен
+        self.respond = None
+
+
+# 🧺 Склейка быстрых сообщений пользователя и отмена устаревших запросов
+class MessageCoalescer:
+    def __init__(self, delay=COALESCE_DELAY):
+        self.delay = delay
+        self._users = {}
+        self.stats = {"messages": 0, "llm_calls": 0, "coalesced": 0, "superseded": 0}
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._users
+
+    def in_flight(self, user_id) -> bool:
+        state = self._users.get(user_id)
+        return bool(state and state.task and not state.task.done())
+
+    # Ставит сообщение в пачку и ждёт, пока на пачку ответят.
+    # respond(user_id, messages) вызывается не больше одного раза одновременно на пользователя.
+    async def submit(self, user_id, message, respond):
+        loop = asyncio.get_running_loop()
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+        self.stats["messages"] += 1
+
+        # Новое сообщение делает текущий ответ устаревшим
+        if state.task is not None and not state.task.done():
+            state.task.cancel()
+            self.stats["superseded"] += 1
+            logging.info("[MessageCoalescer] ✂️ Запрос отменён новым сообщением", extra=fields(user_id=user_id))
+
+        state.messages.append(message)
+        state.respond = respond
+        if state.done is None:
+            state.done = loop.create_future()
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = loop.call_later(self.delay, self._fire, user_id, respond)
+
+        await asyncio.shield(state.done)
+
+    # 🔀 Пользователи переехали на другой воркер: отложенные пачки запускаем сразу, ответы ждём
+    # не дольше timeout, остальное отменяем — отвечать им теперь будет новый владелец
+    async def release(self, keep, timeout):
+        released = [user_id for user_id in self._users if not keep(user_id)]
+        for user_id in released:
+            state = self._users[user_id]
+            if state.timer is not None:
+                state.timer.cancel()
+                state.timer = None
+                state.task = asyncio.create_task(self._run(user_id, state, state.task, state.respond))
+        tasks = [self._users[user_id].task for user_id in released if self._users[user_id].task is not None]
+        tasks = [task for task in tasks if not task.done()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+                logging.warning(f"[MessageCoalescer] ✂️ При передаче пользователей отменено ответов: {len(pending)}")
+        for user_id in released:
+            state = self._users.pop(user_id, None)
+            if state is not None and state.done is not None and not state.done.done():
+                state.done.set_result(None)
+        return released
+
+    def _fire(self, user_id, respond):
+        state = self._users.get(user_id)
+        if state is None:
+            return
+        state.timer = None
+        previous = state.task
+        state.task = asyncio.create_task(self._run(user_id, state, previous, respond))
+
+    async def _run(self, user_id, state, previous, respond):
+        # Гарантия одного запроса в полёте: дожидаемся, пока отменённый доотменяется
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+
+        messages, state.messages = state.messages, []
+        if not messages:
+            return
+        if len(messages) > 1:
+            self.stats["coalesced"] += len(messages) - 1
+            logging.info("[MessageCoalescer] 🧺 Сообщения склеены в один запрос: %s", len(messages),
+                         extra=fields(user_id=user_id, messages=len(messages)))
+        self.stats["llm_calls"] += 1
+
+        try:
+            await respond(user_id, messages)
+        except asyncio.CancelledError:
+            # Эти сообщения уйдут в модель вместе со следующей пачкой
+            state.messages[:0] = messages
+            raise
+        except Exception as e:
+            logging.error(f"[MessageCoalescer] ❌ Ошибка при ответе {user_id}: {e}", exc_info=True)
+
+        if state.timer is None and not state.messages:
+            # Пачка отвечена и новых сообщений нет — освобождаем ждущих и память
+            if state.done is not None and not state.done.done():
+                state.done.set_result(None)
+            self._users.pop(user_id, None)
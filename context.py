@@ -0,0 +1,105 @@
+import os
+import logging
+
+# ⚙️ Бюджет контекста, который уходит в модель на каждом ходу
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MIN_RECENT = int(os.getenv("CONTEXT_MIN_RECENT", "4"))  # столько последних реплик всегда дословно
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+SUMMARY_TURN_CHARS = int(os.getenv("SUMMARY_TURN_CHARS", "200"))
+CONTEXT_LLM_SUMMARY = os.getenv("CONTEXT_LLM_SUMMARY", "0") == "1"
+
+# 📊 Счётчики отправленных токенов (оценка)
+context_stats = {"turns": 0, "tokens_sent": 0, "last_turn_tokens": 0, "compactions": 0}
+
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Бот"}
+
+
+# 🔢 Грубая оценка токенов: для смеси кириллицы и латиницы ~3 символа на токен
+def estimate_tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
+
+# 📝 Локальное сжатие: старые реплики превращаются в короткие строки сводки
+async def compact_summary(previous: str, folded: list) -> str:
+    lines = previous.split("\n") if previous else []
+    for turn in folded:
+        content = " ".join(turn["content"].split())
+        if len(content) > SUMMARY_TURN_CHARS:
+            content = content[:SUMMARY_TURN_CHARS] + "…"
+        lines.append(f"{ROLE_NAMES.get(turn['role'], turn['role'])}: {content}")
+    # Сводка тоже ограничена: самые старые строки уходят первыми
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+# 🧠 Окно диалога: свежие реплики дословно, старые — в сводке
+class ConversationContext:
+    __slots__ = ("budget", "summarizer", "turns", "summary", "tokens", "last_sent_tokens")
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, summarizer=compact_summary):
+        self.budget = budget
+        self.summarizer = summarizer
+        self.turns = []
+        self.summary = ""
+        self.tokens = 0
+        self.last_sent_tokens = 0
+
+    def __len__(self):
+        return len(self.turns)
+
+    # Добавление реплики с соблюдением чередования user/assistant
+    def add(self, role: str, content: str):
+        if self.turns and self.turns[-1]["role"] == role:
+            self.turns[-1]["content"] += "\n" + content
+        else:
+            self.turns.append({"role": role, "content": content})
+        self.tokens += estimate_tokens(content)
+
+    # Сворачиваем старые реплики в сводку, пока окно не влезет в бюджет.
+    # Реплики убираются из окна только вместе с готовой сводкой: если ответ отменят, пока модель
+    # пишет сводку, история останется целой
+    async def compact(self):
+        count, tokens = 0, self.tokens
+        while tokens > self.budget and len(self.turns) - count > CONTEXT_MIN_RECENT:
+            tokens -= estimate_tokens(self.turns[count]["content"])
+            count += 1
+        # Окно должно начинаться с реплики пользователя
+        while count < len(self.turns) and self.turns[count]["role"] != "user":
+            tokens -= estimate_tokens(self.turns[count]["content"])
+            count += 1
+        if not count:
+            return
+        folded = self.turns[:count]
+        try:
+            summary = await self.summarizer(self.summary, folded)
+        except Exception as e:
+            logging.warning(f"[ConversationContext] ⚠️ Ошибка сводки, используем локальное сжатие: {e}")
+            summary = await compact_summary(self.summary, folded)
+        # Пока ждали сводку, в конец окна могли добавиться реплики — начало окна не меняется
+        del self.turns[:count]
+        self.tokens -= sum(estimate_tokens(turn["content"]) for turn in folded)
+        self.summary = summary
+        context_stats["compactions"] += 1
+
+    # Снимок для сохранения на диск (копия, чтобы запись шла без гонок)
+    def to_dict(self) -> dict:
+        return {"turns": [dict(turn) for turn in self.turns], "summary": self.summary}
+
+    def restore(self, data: dict):
+        self.turns = [dict(turn) for turn in data.get("turns", [])]
+        self.summary = data.get("summary", "")
+        self.tokens = sum(estimate_tokens(turn["content"]) for turn in self.turns)
+
+    # Сообщения для chat API (без основного system prompt)
+    def messages(self) -> list:
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Краткое содержание начала разговора:\n{self.summary}"})
+        messages.extend(dict(turn) for turn in self.turns)
+
+        self.last_sent_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        context_stats["turns"] += 1
+        context_stats["tokens_sent"] += self.last_sent_tokens
+        context_stats["last_turn_tokens"] = self.last_sent_tokens
+        return messages
@@ -0,0 +1,71 @@
+import os
+import logging
+import httpx
+
+# ⚙️ Настройки общего HTTP-пула (можно переопределить через переменные окружения)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "90"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+# Единственный клиент на весь процесс
+_client = None
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# 🏗 Создание клиента с пулом соединений
+def create_http_client(**overrides) -> httpx.AsyncClient:
+    http2 = overrides.pop("http2", HTTP2_ENABLED)
+    if http2 and not _http2_available():
+        logging.warning("[http_pool] ⚠️ Пакет h2 не установлен — работаем по HTTP/1.1.")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT,
+        write=HTTP_CONNECT_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+    options = {"limits": limits, "timeout": timeout, "http2": http2}
+    options.update(overrides)
+    return httpx.AsyncClient(**options)
+
+
+# 🚀 Инициализация при старте приложения
+def init_http_client(**overrides) -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client(**overrides)
+        logging.info(f"[http_pool] 🌐 HTTP-клиент создан (max_connections={HTTP_MAX_CONNECTIONS})")
+    return _client
+
+
+# 🔗 Общий клиент для всех исходящих запросов
+def get_http_client() -> httpx.AsyncClient:
+    if _client is None or _client.is_closed:
+        return init_http_client()
+    return _client
+
+
+# 🧹 Закрытие пула при остановке
+async def close_http_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logging.info("[http_pool] 🔒 HTTP-клиент закрыт.")
+    _client = None
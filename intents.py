@@ -0,0 +1,140 @@
+import os
+import re
+import logging
+
+# ⚙️ Локальное распознавание простых намерений до обращения к модели
+INTENT_FUZZY = os.getenv("INTENT_FUZZY", "0") == "1"  # нечёткое совпадение по триграммам (опечатки)
+INTENT_FUZZY_THRESHOLD = float(os.getenv("INTENT_FUZZY_THRESHOLD", "0.45"))
+
+CONFIRM = "confirm"
+IDEAS = "ideas"
+RESTART = "restart"
+GREETING = "greeting"
+THANKS = "thanks"
+
+# Фразы по намерениям (нормализованные: нижний регистр, «ё» → «е»)
+PHRASES = {
+    CONFIRM: ["да", "готово", "готов", "готова", "подтверждаю", "все верно", "го", "давай", "поехали",
+              "погнали", "начинай", "ок", "окей"],
+    IDEAS: ["предложи", "предложить", "предложишь", "идея", "идею", "идеи", "идей", "варианты", "вариант",
+            "подкинь", "посоветуй", "не знаю", "без понятия", "что посоветуешь"],
+    RESTART: ["заново", "сначала", "начать заново", "начнем сначала", "сброс", "сбросить", "рестарт"],
+    GREETING: ["привет", "приветик", "здравствуй", "здравствуйте", "добрый день", "добрый вечер",
+               "доброе утро", "хай", "хелло", "hi", "hello"],
+    THANKS: ["спасибо", "спс", "благодарю", "спасибо большое", "thanks", "thank you"],
+}
+
+# Слова, которые не меняют смысла короткого сообщения
+FILLER = {
+    "а", "и", "ну", "мне", "меня", "мы", "нам", "пожалуйста", "плиз", "какие", "какую", "какой", "нибудь",
+    "что", "то", "можно", "есть", "у", "тебя", "дай", "пару", "несколько", "еще", "тогда", "бот", "ладно",
+    "хорошо", "все", "просто", "очень", "тебе", "вам", "давайте", "там", "может", "по", "с",
+}
+
+_TOKEN = re.compile(r"[a-zа-я0-9]+")
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower().replace("ё", "е"))
+
+
+# 🌲 Префиксное дерево по словам: многословные фразы находятся за один проход
+class PhraseTrie:
+    END = "$"
+
+    def __init__(self, phrases: dict):
+        self.root = {}
+        for intent, items in phrases.items():
+            for phrase in items:
+                node = self.root
+                for token in tokenize(phrase):
+                    node = node.setdefault(token, {})
+                node[self.END] = intent
+
+    # Самые длинные совпадения слева направо: [(intent, начало, конец)]
+    def scan(self, tokens: list) -> list:
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self.root
+            found = None
+            j = i
+            while j < len(tokens) and tokens[j] in node:
+                node = node[tokens[j]]
+                j += 1
+                if self.END in node:
+                    found = (node[self.END], i, j)
+            if found:
+                matches.append(found)
+                i = found[2]
+            else:
+                i += 1
+        return matches
+
+
+class Intent:
+    __slots__ = ("name", "pure", "tokens")
+
+    def __init__(self, name, pure, tokens):
+        self.name = name    # None — ничего не распознано
+        self.pure = pure    # сообщение целиком состоит из этого намерения (и слов-связок)
+        self.tokens = tokens
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, pure={self.pure})"
+
+
+def _trigrams(word):
+    word = f"  {word} "
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class IntentRouter:
+    def __init__(self, phrases=PHRASES, filler=FILLER, fuzzy=INTENT_FUZZY):
+        self.trie = PhraseTrie(phrases)
+        self.filler = frozenset(filler)
+        self.fuzzy = fuzzy
+        # Маленькая «модель» для опечаток: триграммы однословных фраз
+        self._fuzzy_index = [
+            (intent, _trigrams(phrase)) for intent, items in phrases.items() for phrase in items if " " not in phrase
+        ]
+        self.stats = {"llm_calls_avoided": 0}
+
+    def classify(self, text: str) -> Intent:
+        tokens = tokenize(text)
+        matches = self.trie.scan(tokens)
+        if not matches and self.fuzzy and len(tokens) == 1 and len(tokens[0]) >= 4:
+            guess = self._fuzzy(tokens[0])
+            if guess:
+                return Intent(guess, True, tokens)
+        if not matches:
+            return Intent(None, False, tokens)
+
+        intents = {intent for intent, _, _ in matches}
+        # Главное намерение — самое частое; при равенстве — первое
+        name = max(intents, key=lambda x: (sum(1 for m in matches if m[0] == x), -[m[0] for m in matches].index(x)))
+        covered = set()
+        for intent, start, end in matches:
+            if intent == name:
+                covered.update(range(start, end))
+        pure = len(intents) == 1 and all(i in covered or t in self.filler for i, t in enumerate(tokens))
+        return Intent(name, pure, tokens)
+
+    def _fuzzy(self, word):
+        grams = _trigrams(word)
+        best, score = None, 0.0
+        for intent, phrase_grams in self._fuzzy_index:
+            similarity = len(grams & phrase_grams) / len(grams | phrase_grams)
+            if similarity > score:
+                best, score = intent, similarity
+        if score >= INTENT_FUZZY_THRESHOLD:
+            logging.debug(f"[IntentRouter] 🔎 «{word}» похоже на {best} ({score:.2f})")
+            return best
+        return None
+
+    def avoided(self, intent_name):
+        self.stats["llm_calls_avoided"] += 1
+        self.stats[intent_name] = self.stats.get(intent_name, 0) + 1
+
+
+intent_router = IntentRouter()
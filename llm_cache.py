@@ -0,0 +1,76 @@
+import os
+import copy
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+# ⚙️ Настройки кэша ответов модели
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_PREWARM = os.getenv("LLM_CACHE_PREWARM", "1") == "1"
+
+
+# 🔑 Ключ: модель + system prompt + нормализованные сообщения
+def make_cache_key(model: str, system_prompt: str, messages: list) -> str:
+    normalized = [
+        [m.get("role"), " ".join(str(m.get("content", "")).lower().split())]
+        for m in messages
+    ]
+    raw = json.dumps([model, system_prompt, normalized], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# 🗃 Кэш с ограничением размера, TTL и вытеснением давно не использованных (LRU)
+class ResponseCache:
+    def __init__(self, max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+response_cache = ResponseCache()
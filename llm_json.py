@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import logging
+
+from logs import fields
+
+# ⚙️ Структурированные ответы модели
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "json_schema")  # json_schema | json_object | off
+JSON_REPAIR_ATTEMPTS = int(os.getenv("JSON_REPAIR_ATTEMPTS", "20"))  # укорачиваний оборванного JSON
+JSON_FALLBACK_STARTS = int(os.getenv("JSON_FALLBACK_STARTS", "50"))  # '{', с которых пробуем разбор вслепую
+
+KNOWN_STATUSES = ("need_more_info", "ready_to_generate", "ready_to_start_code_phase")
+
+# Схема ответа в режиме чата: её же ждут answer_dialog и format_suggestions
+IDEA_SCHEMA = {
+    "anyOf": [
+        {"type": "string"},
+        {"type": "object", "properties": {"название": {"type": "string"}, "описание": {"type": "string"}},
+         "required": ["название", "описание"]},
+    ]
+}
+REPLY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "status": {"type": "string", "enum": list(KNOWN_STATUSES)},
+        "reply": {"type": "string"},
+        "task": {"type": "string"},
+        "goal": {"type": "string"},  # назначение инструмента при ready_to_start_code_phase
+        "params": {"type": "object", "properties": {"вопросы": {"type": "array", "items": IDEA_SCHEMA}}},
+    },
+    "required": ["status", "reply"],
+}
+
+# ok — ровно один объект; recovered — склеили несколько, достроили оборванный или нашли среди прозы
+parse_stats = {"ok": 0, "recovered": 0, "failed": 0}
+
+_SPECIAL = re.compile(r'["\\{}\[\]]')
+_CLOSING = {"{": "}", "[": "]"}
+
+
+def parse_failure_ratio() -> float:
+    total = sum(parse_stats.values())
+    return parse_stats["failed"] / total if total else 0.0
+
+
+# 📐 response_format для OpenRouter; если провайдер его не принимает — дальше просим без него
+class StructuredOutput:
+    def __init__(self, mode=LLM_RESPONSE_FORMAT):
+        self.mode = mode
+        self.supported = mode != "off"
+
+    def payload_fields(self) -> dict:
+        if not self.supported:
+            return {}
+        if self.mode == "json_object":
+            return {"response_format": {"type": "json_object"}}
+        return {"response_format": {"type": "json_schema", "json_schema": {
+            "name": "toolbot_reply", "strict": False, "schema": REPLY_SCHEMA}}}
+
+    # 400 из-за response_format: отключаем его и повторяем запрос. Иные ошибки — не наше дело
+    def rejected(self, error) -> bool:
+        response = getattr(error, "response", None)
+        if not self.supported or response is None or response.status_code != 400:
+            return False
+        text = response.text.lower()
+        if not any(word in text for word in ("response_format", "json_schema", "structured")):
+            return False
+        self.supported = False
+        logging.warning(f"[StructuredOutput] ⚠️ Модель не принимает response_format, просим JSON только промптом: "
+                        f"{response.text[:200]}")
+        return True
+
+
+# 🧩 Разбор ответа по мере прихода: объекты верхнего уровня выделяются по скобкам с учётом строк,
+# проза вокруг и блоки ```json пропускаются. Каждый символ просматривается один раз
+class ReplyParser:
+    def __init__(self):
+        self.text = ""
+        self.objects = []  # законченные объекты верхнего уровня
+        self._pos = 0
+        self._start = -1  # начало текущего объекта
+        self._stack = []  # ожидаемые закрывающие скобки
+        self._in_string = False
+        self._skip = -1  # символ после '\' внутри строки
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        text = self.text
+        for match in _SPECIAL.finditer(text, self._pos):
+            i = match.start()
+            ch = match.group()
+            if i == self._skip:
+                continue
+            if self._in_string:
+                if ch == "\\":
+                    self._skip = i + 1
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack:
+                if ch == "{":
+                    self._start = i
+                    self._stack.append("}")
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in _CLOSING:
+                self._stack.append(_CLOSING[ch])
+            elif ch in "}]":
+                if ch != self._stack[-1]:
+                    self._stack = []  # скобки не сошлись — это была не JSON-структура
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    self._complete(text[self._start:i + 1])
+        self._pos = len(text)
+
+    def _complete(self, raw):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        if isinstance(data, dict):
+            self.objects.append(data)
+
+    # Итог разбора: нормализованный ответ или None
+    def finish(self):
+        replies = [data for data in self.objects if _is_reply(data)]
+        recovered = len(replies) > 1
+        if not replies:
+            replies = self._scan() or self._repair()
+            recovered = True
+        if not replies:
+            parse_stats["failed"] += 1
+            logging.warning("[ReplyParser] ❌ В ответе модели нет JSON-ответа", extra=fields(payload=self.text))
+            return None
+        parse_stats["recovered" if recovered else "ok"] += 1
+        if recovered:
+            logging.info(f"[ReplyParser] 🩹 Ответ модели восстановлен ({len(replies)} объект(а))",
+                         extra=fields(payload=self.text))
+        merged = dict(replies[0])
+        for data in replies[1:]:
+            for key, value in data.items():
+                merged.setdefault(key, value)  # второй объект дополняет первый, но не перетирает
+        return normalize(merged)
+
+    # Вслепую: разбор с каждой '{' — помогает, если в прозе перед JSON осталась незакрытая скобка
+    def _scan(self):
+        decoder = json.JSONDecoder()
+        start = self.text.find("{")
+        for _ in range(JSON_FALLBACK_STARTS):
+            if start == -1:
+                break
+            try:
+                data, _ = decoder.raw_decode(self.text, start)
+            except ValueError:
+                data = None
+            if _is_reply(data):
+                return [data]
+            start = self.text.find("{", start + 1)
+        return []
+
+    # Оборванный ответ: закрываем строку и скобки, при неудаче отрезаем хвост до запятой
+    def _repair(self):
+        if not self._stack or self._start == -1:
+            return []
+        text = self.text[self._start:]
+        for _ in range(JSON_REPAIR_ATTEMPTS):
+            try:
+                data = json.loads(_close(text))
+            except ValueError:
+                data = None
+            if _is_reply(data):
+                return [data]
+            cut = text.rfind(",")
+            if cut <= 0:
+                break
+            text = text[:cut]
+        return []
+
+
+def _close(text) -> str:
+    stack = []
+    in_string = False
+    skip = -1
+    for match in _SPECIAL.finditer(text):
+        i = match.start()
+        ch = match.group()
+        if i == skip:
+            continue
+        if in_string:
+            if ch == "\\":
+                skip = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in _CLOSING:
+            stack.append(_CLOSING[ch])
+        elif ch in "}]" and stack:
+            stack.pop()
+    if skip == len(text):
+        text = text[:-1]  # оборвалось на '\' посреди экранирования
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def _is_reply(data) -> bool:
+    return isinstance(data, dict) and ("status" in data or "reply" in data)
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+
+
+# ✅ Приводим ответ к схеме: строки — строками, params — словарь, вопросы — список строк или идей
+def normalize(data: dict) -> dict:
+    status = data.get("status")
+    params = data.get("params")
+    params = dict(params) if isinstance(params, dict) else {}
+    if "вопросы" in params:
+        params["вопросы"] = _questions(params["вопросы"])
+    return {
+        "status": status if isinstance(status, str) and status else "need_more_info",
+        "reply": _text(data.get("reply")),
+        "task": _text(data.get("task")),
+        "goal": _text(data.get("goal")),
+        "params": params,
+    }
+
+
+def _questions(value) -> list:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    questions = []
+    for item in value:
+        if isinstance(item, dict):
+            questions.append({"название": _text(item.get("название")) or "Без названия",
+                              "описание": _text(item.get("описание")) or "Без описания"})
+        elif item is not None and str(item).strip():
+            questions.append(str(item).strip())
+    return questions
+
+
+def parse_reply(text: str):
+    parser = ReplyParser()
+    parser.feed(text)
+    return parser.finish()
+
+
+structured_output = StructuredOutput()
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+# ⚙️ Ограничения на запросы к модели
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # одновременно в OpenRouter
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))  # сверх этого сразу отвечаем «занято»
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "3"))  # ожидающих + выполняющихся на пользователя
+
+# 🎚 Приоритеты: меньше — важнее
+PRIORITY_CODE = 0        # пользователь подтвердил и ждёт генерацию
+PRIORITY_CHAT = 1        # обычный диалог
+PRIORITY_IDEAS = 2       # генерация идей
+PRIORITY_BACKGROUND = 3  # прогрев кэша, сводки истории
+PRIORITIES = (PRIORITY_CODE, PRIORITY_CHAT, PRIORITY_IDEAS, PRIORITY_BACKGROUND)
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+# 🚦 Планировщик: общий лимит, честная очередь по пользователям внутри приоритета
+class LLMScheduler:
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, max_per_user=LLM_MAX_PER_USER):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.running = 0
+        self.queued = 0
+        # priority -> OrderedDict(user_id -> deque[future]); порядок ключей = очередь round-robin
+        self._queues = {p: OrderedDict() for p in PRIORITIES}
+        self._per_user = {}  # user_id -> ожидающих + выполняющихся
+        self.wait_samples = deque(maxlen=2000)
+        self.stats = {"granted": 0, "rejected": 0, "cancelled": 0}
+
+    # Захват слота; SchedulerBusy — если очередь переполнена
+    async def acquire(self, user_id=None, priority=PRIORITY_CHAT):
+        if self.max_per_user and user_id is not None and self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.stats["rejected"] += 1
+            raise SchedulerBusy(f"у пользователя {user_id} уже {self.max_per_user} запросов")
+        if self.running < self.max_concurrency and self.queued == 0:
+            self.running += 1
+            self.stats["granted"] += 1
+            self._inc_user(user_id)
+            self.wait_samples.append(0.0)
+            return
+        if self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise SchedulerBusy(f"очередь переполнена ({self.queued})")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        self._inc_user(user_id)
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user_id)  # слот уже выдан — возвращаем
+            else:
+                self._forget(priority, user_id, future)
+            self.stats["cancelled"] += 1
+            raise
+        self.wait_samples.append(time.monotonic() - started)
+
+    def release(self, user_id=None):
+        self.running -= 1
+        self._dec_user(user_id)
+        self._dispatch()
+
+    def slot(self, user_id=None, priority=PRIORITY_CHAT):
+        return _Slot(self, user_id, priority)
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency and self.queued:
+            for priority in PRIORITIES:
+                users = self._queues[priority]
+                if users:
+                    break
+            else:
+                return
+            user_id, waiters = next(iter(users.items()))
+            future = waiters.popleft()
+            # Пользователь уходит в конец очереди своего приоритета
+            if waiters:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            self.queued -= 1
+            if future.cancelled():
+                self._dec_user(user_id)
+                continue
+            self.running += 1
+            self.stats["granted"] += 1
+            future.set_result(None)
+
+    def _forget(self, priority, user_id, future):
+        waiters = self._queues[priority].get(user_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._queues[priority][user_id]
+            self.queued -= 1
+            self._dec_user(user_id)
+
+    def _inc_user(self, user_id):
+        if user_id is not None:
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+    def _dec_user(self, user_id):
+        if user_id is None:
+            return
+        left = self._per_user.get(user_id, 0) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
+
+    # 📊 Очередь и время ожидания
+    def snapshot(self) -> dict:
+        waits = sorted(self.wait_samples)
+
+        def pct(q):
+            return round(waits[min(len(waits) - 1, int(len(waits) * q))], 4) if waits else 0.0
+
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "queued_by_priority": {p: sum(len(w) for w in self._queues[p].values()) for p in PRIORITIES},
+            "wait_p50": pct(0.5),
+            "wait_p95": pct(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+            **self.stats,
+        }
+
+
+class _Slot:
+    def __init__(self, scheduler, user_id, priority):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.user_id, self.priority)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(self.user_id)
+        return False
+
+
+llm_scheduler = LLMScheduler()
+
+
+def log_snapshot():
+    snap = llm_scheduler.snapshot()
+    logging.info(
+        f"[LLMScheduler] 🚦 В работе: {snap['running']}, в очереди: {snap['queued']}, "
+        f"ожидание p95: {snap['wait_p95'] * 1000:.0f} мс, отказов: {snap['rejected']}"
+    )
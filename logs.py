@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import hashlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# ⚙️ Логи: запись в очередь на event loop, форматирование и вывод — в отдельном потоке
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_REDACT = os.getenv("LOG_REDACT", "1") == "1"  # тексты пользователей и ответы модели не пишем
+LOG_MAX_FIELD = int(os.getenv("LOG_MAX_FIELD", "500"))  # символов на поле без редактирования
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.1"))  # доля DEBUG-событий каждого вида
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # сверх этого записи отбрасываются
+
+# Поля с пользовательским содержимым
+REDACTED_FIELDS = {"text", "history", "payload", "reply"}
+
+
+# Структурированные поля записи: logging.info("...", extra=fields(user_id=1, stage="llm_request"))
+def fields(**values) -> dict:
+    return {"fields": values}
+
+
+def _render_value(name, value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    if LOG_REDACT and name in REDACTED_FIELDS:
+        digest = hashlib.sha1(value.encode("utf-8")).hexdigest()[:8]
+        return f"<скрыто: {len(value)} симв., {digest}>"
+    if len(value) > LOG_MAX_FIELD:
+        return f"{value[:LOG_MAX_FIELD]}…(+{len(value) - LOG_MAX_FIELD})"
+    return value
+
+
+def _record_fields(record) -> dict:
+    values = getattr(record, "fields", None) or {}
+    return {name: _render_value(name, value) for name, value in values.items() if value is not None}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_record_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        extra = " ".join(f"{name}={value}" for name, value in _record_fields(record).items())
+        return f"{line} | {extra}" if extra else line
+
+
+# 🎲 DEBUG-события прореживаются: из каждых N записей одного вида проходит одна
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=LOG_DEBUG_SAMPLE):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.seen = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if not self.every:
+            self.dropped += 1
+            return False
+        key = (record.pathname, record.lineno)  # вид события — место вызова
+        count = self.seen.get(key, 0)
+        self.seen[key] = count + 1
+        if count % self.every:
+            self.dropped += 1
+            return False
+        return True
+
+
+# Запись уходит в очередь как есть: сообщение собирается из args уже в потоке вывода
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1  # вывод не успевает — лучше потерять строку лога, чем встать
+
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+# Дописывает очередь и останавливает поток вывода
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,56 +1,122 @@
 import os
+import time
 import logging
-import json
 import httpx
 import asyncio
-import time
-from threading import Thread
-from flask import Flask
+import signal
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from aiogram.utils import executor
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher.filters import CommandStart
-from io import BytesIO
-from zipfile import ZipFile
-from collections import defaultdict, deque
-
-user_sessions = {}
-
-# Отслеживание подтверждения генерации
-user_states = {}
-
-user_goals = {}  # user_id -> goal (назначение будущего инструмента)
-
-# Режимы работы пользователей: 'chat' или 'code'
-user_modes = defaultdict(lambda: 'chat')
-
-# ⬆️ Сессии
-sessions = defaultdict(lambda: {"history": [], "last_active": time.time()})
+from http_pool import init_http_client, get_http_client, close_http_client
+from streaming import LLM_STREAMING, ProgressiveReply, stream_chat_completion
+from context import ConversationContext, CONTEXT_LLM_SUMMARY, compact_summary, context_stats
+from session_store import SessionStore, SESSION_CLEANUP_INTERVAL, log_stats
+from session_backend import create_backend, SESSION_DB_PATH
+from coalescer import MessageCoalescer
+from llm_scheduler import llm_scheduler, SchedulerBusy, PRIORITY_CODE, PRIORITY_CHAT, PRIORITY_IDEAS, PRIORITY_BACKGROUND, log_snapshot
+from webapp import UpdateProcessor, create_web_app, start_web_app, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET
+from resilience import openrouter_resilience, CircuitOpen, is_model_failure, LLM_TOTAL_TIMEOUT
+import metrics
+from metrics import timed, record_usage, llm_status
+from llm_cache import response_cache, make_cache_key, LLM_CACHE_ENABLED, LLM_CACHE_PREWARM, LLM_CACHE_TTL
+from intents import intent_router, CONFIRM, IDEAS, RESTART, GREETING, THANKS
+from logs import setup_logging, shutdown_logging, fields
+from outbox import outbox
+from artifacts import artifact_builder, ArtifactTooLarge
+from workers import Router, WorkerLink, BOT_WORKERS, WORKER_HANDOFF_TIMEOUT, update_user_id
+from llm_json import ReplyParser, structured_output, parse_stats, parse_failure_ratio, KNOWN_STATUSES
+
+# ⬆️ Сессии: режим, история, цель и метки времени каждого пользователя в одном объекте
+def new_context():
+    summarizer = summarize_history if CONTEXT_LLM_SUMMARY else compact_summary
+    return ConversationContext(summarizer=summarizer)
+
+
+sessions = SessionStore(context_factory=new_context)
+
+# 🧺 Быстрые сообщения одного пользователя склеиваются в один запрос к модели
+coalescer = MessageCoalescer()
 
 
 # Настройка логирования
 # logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 logging.getLogger("aiogram.event").setLevel(logging.WARNING)
 
+# Запрос идей, когда пользователь не знает, какой инструмент хочет
+SUGGESTION_PROMPT = (
+    "Пользователь пока не определился с инструментом. "
+    "Предложи 3-5 идей полезных инструментов или скриптов на основе нейросетей или Python. "
+    "Кратко опиши назначение каждого, чтобы пользователь мог выбрать."
+)
+
+# Быстрый ответ, когда очередь к модели переполнена
+BUSY_REPLY = "⏳ Сейчас очень много запросов. Попробуй ещё раз через минуту."
+UNAVAILABLE_REPLY = "🔌 Модель сейчас недоступна. Попробуй ещё раз через минуту — сообщение можно не перепечатывать, просто напиши «ещё раз»."
+
 # ключевые слова для переключения из чата в код-режим
 CONFIRM_WORDS = ["да", "готово", "подтверждаю", "всё верно"]
 
+# Ответы без модели на короткие реплики (см. intents.py)
+GREETING_REPLY = "Привет! Опиши, какой инструмент тебе нужен 🧠"
+THANKS_REPLY = "Пожалуйста! Если захочешь доработать инструмент или сделать новый — просто напиши."
+RESTART_REPLY = "🔄 Начинаем заново! Опиши, какой инструмент тебе нужен 🧠"
+
 # 🔐 Токены и ключи
 BOT_TOKEN = os.getenv("TOOLBOT_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+PING_URL = os.getenv("PING_URL", "https://tools-bot.onrender.com")
+LLM_MODEL = os.getenv("LLM_MODEL", "google/gemma-3-27b-it")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")  # свой Bot API сервер; пусто — api.telegram.org
 
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+bot = Bot(token=BOT_TOKEN, parse_mode="HTML",
+          server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot)
-logging.basicConfig(level=logging.INFO)
-
-app = Flask(__name__)
+setup_logging()  # вывод логов — в отдельном потоке, см. logs.py
+
+# 📈 Gauge-метрики и счётчики из stats-словарей вычисляются только при опросе /metrics
+metrics.gauge("toolbot_sessions_active", "Активные сессии", lambda: len(sessions))
+metrics.gauge("toolbot_sessions_by_mode", "Сессии по режимам", lambda: sessions.count_by_mode(), labels=("mode",))
+metrics.gauge("toolbot_llm_running", "Запросы к модели в работе", lambda: llm_scheduler.running)
+metrics.gauge("toolbot_llm_queued", "Запросы к модели в очереди", lambda: llm_scheduler.queued)
+metrics.counter_func("toolbot_llm_rejected_total", "Отказы «занято»", lambda: llm_scheduler.stats["rejected"])
+metrics.gauge("toolbot_llm_cache_size", "Записей в кэше ответов модели", lambda: response_cache.stats()["size"])
+metrics.counter_func("toolbot_llm_cache_total", "Обращения к кэшу ответов модели", lambda: {
+    k: v for k, v in response_cache.stats().items() if k in ("hits", "misses")}, labels=("kind",))
+metrics.gauge("toolbot_breaker_open", "Предохранитель модели разомкнут", lambda: {
+    model: int(breaker.state != "closed") for model, breaker in openrouter_resilience.breakers.items()}, labels=("model",))
+metrics.gauge("toolbot_coalescer_users", "Пользователи с неотвеченными сообщениями", lambda: len(coalescer))
+metrics.counter_func("toolbot_llm_calls_avoided_total", "Сообщения, отвеченные без модели, по намерениям", lambda: {
+    k: v for k, v in intent_router.stats.items() if k != "llm_calls_avoided"}, labels=("intent",))
+metrics.gauge("toolbot_outbox_queued", "Сообщения в очереди на отправку в Telegram", lambda: outbox.queued())
+metrics.counter_func("toolbot_outbox_total", "Исходящие в Telegram", lambda: outbox.stats, labels=("kind",))
+metrics.counter_func("toolbot_llm_parse_total", "Разбор JSON-ответов модели: ok, recovered, failed", lambda: parse_stats,
+                     labels=("result",))
+metrics.gauge("toolbot_llm_parse_failure_ratio", "Доля ответов модели без JSON", parse_failure_ratio)
+metrics.counter_func("toolbot_context_tokens_sent_total", "Оценка токенов диалога, отправленных в модель",
+                     lambda: context_stats["tokens_sent"])
+metrics.counter_func("toolbot_context_turns_total", "Ходы диалога, отправленные в модель",
+                     lambda: context_stats["turns"])
+metrics.counter_func("toolbot_context_compactions_total", "Сворачивания старых реплик в сводку",
+                     lambda: context_stats["compactions"])
+
+
+# 🌐 Один aiohttp-сервер в том же event loop: health-check и webhook Telegram
+updates = UpdateProcessor(dp)
+app = create_web_app(updates)
+metrics.gauge("toolbot_updates_in_flight", "Апдейты Telegram в обработке", lambda: len(updates.tasks))
 
 
 # Обновления сессии
 def update_user_session(user_id, user_message):
-    sessions[user_id]["history"].append({"role": "user", "content": user_message})
-    sessions[user_id]["last_active"] = time.time()
-    logging.info(f"📚 Обновлена сессия пользователя {user_id}: {user_message[:50]}...")
+    session = sessions.get_or_create(user_id)
+    session.context.add("user", user_message)
+    sessions.touch(session)
+    sessions.save(session)
+    logging.debug("📚 Обновлена сессия пользователя", extra=fields(user_id=user_id, text=user_message))
+    return session
 
 
 
@@ -77,46 +143,87 @@ prompt_chat, prompt_code = load_system_prompts()
 async def ping_render():
     while True:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get("https://tools-bot.onrender.com")
-                logging.info(f"🔄 Пинг на Render: {response.status_code}")
+            response = await get_http_client().get(PING_URL)
+            logging.info(f"🔄 Пинг на Render: {response.status_code}")
         except Exception as e:
             logging.warning(f"⚠️ Ошибка при пинге Render: {e}")
         await asyncio.sleep(300)  # каждые 14 минут
 
 
 
-# 🧠 Парсинг JSON из текста
-def extract_json(text: str) -> dict:
-    logging.debug(f"[extract_json] 🔍 Пытаемся извлечь JSON из текста:\n{text}")
+# 📨 Простой запрос к OpenRouter: возвращает текст ответа модели
+async def call_openrouter(messages, user_id=None, priority=PRIORITY_CHAT):
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {"model": LLM_MODEL, "messages": messages}
+    async with llm_scheduler.slot(user_id, priority):
+        response = await openrouter_resilience.post(get_http_client(), OPENROUTER_URL, payload, headers)
+    result = response.json()
+    record_usage(result.get("model") or LLM_MODEL, result.get("usage"))
+    return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+# 📝 Сводка старой части диалога силами модели (CONTEXT_LLM_SUMMARY=1)
+async def summarize_history(previous, folded):
+    dialog = "\n".join(f"{turn['role']}: {turn['content']}" for turn in folded)
+    messages = [
+        {"role": "system", "content": "Кратко (до 5 предложений) перескажи диалог, сохранив все требования пользователя к инструменту. Ответь только текстом сводки."},
+        {"role": "user", "content": f"Предыдущая сводка:\n{previous or '—'}\n\nНовые реплики:\n{dialog}"}
+    ]
+    summary = await call_openrouter(messages, priority=PRIORITY_BACKGROUND)
+    return summary.strip() or await compact_summary(previous, folded)
+
+
+# 📡 Потоковое получение ответа: JSON разбирается по мере прихода. None — стрим не удался, нужен обычный запрос
+# Стрим укладывается в тот же LLM_TOTAL_TIMEOUT, что и обычный запрос: остаток бюджета получит запасной путь
+async def stream_content(payload, headers, on_delta, deadline):
+    parser = ReplyParser()
+    breaker = openrouter_resilience.breaker(payload["model"])
+    if breaker.state != "closed":
+        return None  # модель сбоит — сразу идём путём с повторами и запасными моделями
+
+    async def read():
+        async for delta in stream_chat_completion(get_http_client(), OPENROUTER_URL, payload, headers):
+            parser.feed(delta)
+            await on_delta(parser.text)
+
     try:
-        start = text.find("{")
-        end = text.rfind("}") + 1
-        if start != -1 and end != -1:
-            json_str = text[start:end]
-            result = json.loads(json_str)
-            logging.debug(f"[extract_json] ✅ Успешно извлечён JSON:\n{result}")
-            return result
-        logging.warning(f"[extract_json] Не найдено фигурных скобок для JSON.")
+        await asyncio.wait_for(read(), deadline - time.monotonic())
+        breaker.record_success()
+        return parser
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        logging.warning(f"[stream_content] ⏱ Стрим не уложился в {LLM_TOTAL_TIMEOUT:.0f} с ({len(parser.text)} симв.)")
         return None
-    except json.JSONDecodeError as je:
-        logging.error(f"[extract_json] ❌ Ошибка при разборе JSON: {je}")
     except Exception as e:
-        logging.error(f"[extract_json] ❌ Неизвестная ошибка: {e}")
-    return None
+        if is_model_failure(e):
+            breaker.record_failure()  # 4xx (ключ, отвергнутый response_format) — не вина модели
+        logging.warning(f"[stream_content] ⚠️ Стрим прерван ({len(parser.text)} симв.), переходим на обычный запрос: {e}")
+        return None
 
 
-        
-
-async def analyze_message(history: str, prompt, mode="chat"):
-    if mode == 'code':
-        prompt = [
-            {"role": "system", "content": prompt_code},
-            {"role": "user", "content": history}
-        ]
+# Обычный запрос; если провайдер отверг response_format — тот же запрос без него
+async def post_structured(payload, headers, deadline=None):
+    try:
+        return await openrouter_resilience.post(get_http_client(), OPENROUTER_URL, payload, headers, deadline)
+    except httpx.HTTPStatusError as e:
+        if "response_format" not in payload or not structured_output.rejected(e):
+            raise
+    payload = {key: value for key, value in payload.items() if key != "response_format"}
+    return await openrouter_resilience.post(get_http_client(), OPENROUTER_URL, payload, headers, deadline)
+
+
+async def analyze_message(history, prompt, mode="chat", on_delta=None, refresh_cache=False,
+                          user_id=None, priority=PRIORITY_CHAT, cache_only=False):
+    system_prompt = prompt_code if mode == 'code' else prompt_chat
+    if isinstance(history, list):
+        # Уже готовый диалог с чередованием ролей
+        prompt = [{"role": "system", "content": system_prompt}] + history
     else:
         prompt = [
-            {"role": "system", "content": prompt_chat},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": history}
         ]
 
@@ -125,13 +232,38 @@ async def analyze_message(history: str, prompt, mode="chat"):
         "Content-Type": "application/json"
     }
 
-    payload = {"model": "google/gemma-3-27b-it", "messages": prompt}
+    payload = {"model": LLM_MODEL, "messages": prompt, **structured_output.payload_fields()}
+
+    # 🗃 Одинаковые запросы (идеи, типовые первые сообщения) отдаём из кэша
+    cache_key = make_cache_key(LLM_MODEL, system_prompt, prompt[1:]) if LLM_CACHE_ENABLED else None
+    if cache_key and not refresh_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logging.info("[analyze_message] 🗃 Ответ из кэша", extra=fields(user_id=user_id))
+            return cached
+    if cache_only:
+        return None  # быстрый путь: без кэша в модель не идём
+
+    # 🚦 Очередь к модели: общий лимит и честность между пользователями
+    try:
+        with timed("llm_queue_wait"):
+            await llm_scheduler.acquire(user_id, priority)
+    except SchedulerBusy as e:
+        logging.warning(f"[analyze_message] 🚦 Очередь занята: {e}")
+        return {"status": "need_more_info", "reply": BUSY_REPLY}
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers)
-            logging.debug(f"[analyze_message] 📥 Ответ от OpenRouter:\n{response.text}")
-            response.raise_for_status()
+        parser = None
+        deadline = time.monotonic() + LLM_TOTAL_TIMEOUT  # на стрим и запасной обычный запрос вместе
+        if on_delta is not None and LLM_STREAMING:
+            with timed("llm_request"):
+                parser = await stream_content(payload, headers, on_delta, deadline)
+
+        if parser is None:
+            # Повторы при 429/5xx, предохранитель и запасные модели
+            with timed("llm_request"):
+                response = await post_structured(payload, headers, deadline)
+            logging.debug("[analyze_message] 📥 Ответ от OpenRouter", extra=fields(user_id=user_id, payload=response.content))
 
             try:
                 result = response.json()
@@ -142,59 +274,75 @@ async def analyze_message(history: str, prompt, mode="chat"):
                     "reply": "⚠️ Не удалось распознать ответ от модели. Попробуй переформулировать."
                 }
 
+            record_usage(result.get("model") or LLM_MODEL, result.get("usage"))
             content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            if not content:
-                logging.warning("[analyze_message] ❗️Пустой content в ответе.")
-                return {
-                    "status": "need_more_info",
-                    "reply": "Ответ от модели был пуст. Попробуй ещё раз описать задачу."
-                }
+            parser = ReplyParser()
+            parser.feed(content or "")
 
-            logging.debug(f"[analyze_message] 🧠 Содержимое content:\n{content}")
-            result_dict = extract_json(content)
+        if not parser.text:
+            logging.warning("[analyze_message] ❗️Пустой content в ответе.")
+            return {
+                "status": "need_more_info",
+                "reply": "Ответ от модели был пуст. Попробуй ещё раз описать задачу."
+            }
 
-            if not result_dict:
-                logging.error("[analyze_message] ❌ Не удалось извлечь JSON из содержимого.")
-                return {
-                    "status": "need_more_info",
-                    "reply": "Извини, я не понял твою задачу. Можешь объяснить чуть подробнее?"
-                }
+        logging.debug("[analyze_message] 🧠 Содержимое content", extra=fields(user_id=user_id, payload=parser.text))
+        with timed("extract_json"):
+            parsed = parser.finish()  # уже проверен по схеме: status, reply, task, params.вопросы
 
-            logging.info(f"[analyze_message] ✅ Успешный разбор результата: {result_dict}")
+        if not parsed:
+            logging.error("[analyze_message] ❌ Не удалось извлечь JSON из содержимого.")
             return {
-                "status": result_dict.get("status", "need_more_info"),
-                "reply": result_dict.get("reply"),
-                "task": result_dict.get("task"),
-                "params": result_dict.get("params"),
+                "status": "need_more_info",
+                "reply": "Извини, я не понял твою задачу. Можешь объяснить чуть подробнее?"
             }
 
+        logging.info("[analyze_message] ✅ Успешный разбор результата",
+                     extra=fields(user_id=user_id, status=parsed["status"], payload=parsed))
+        if cache_key:
+            response_cache.set(cache_key, parsed)  # кэшируем только удачный разбор
+        return parsed
+
+    except CircuitOpen as e:
+        logging.error(f"[analyze_message] 🔌 {e}")
+        return {"status": "need_more_info", "reply": UNAVAILABLE_REPLY}
+
     except httpx.RequestError as e:
         logging.error(f"[analyze_message] 🔌 Ошибка при запросе к OpenRouter: {e}")
         return {"status": "need_more_info", "reply": "Ошибка при соединении с OpenRouter."}
 
+    except httpx.HTTPStatusError as e:
+        logging.error(f"[analyze_message] 🔌 OpenRouter ответил ошибкой: {e}")
+        return {"status": "need_more_info", "reply": UNAVAILABLE_REPLY}
+
     except Exception as e:
         logging.error(f"[analyze_message] ❗️ Произошла непредвиденная ошибка: {e}")
         return {"status": "need_more_info", "reply": "Произошла непредвиденная ошибка."}
 
+    finally:
+        llm_scheduler.release(user_id)
+
 
 
 
 # 🧠 Функция анализа требований в режиме чата
-async def summarize_requirements(messages_text, system_prompt, user_session):
+async def summarize_requirements(messages_text, system_prompt, user_session, on_delta=None):
     try:
-        logging.info("[summarize_requirements] Отправка текста в analyze_message()")
-        response = await analyze_message(messages_text, system_prompt, mode="chat")
-        logging.info(f"[summarize_requirements] Получен исходный ответ:\n{response}")
+        logging.debug("[summarize_requirements] Отправка текста в analyze_message()")
+        response = await analyze_message(messages_text, system_prompt, mode="chat", on_delta=on_delta,
+                                         user_id=user_session.user_id)
+        logging.debug("[summarize_requirements] Получен исходный ответ",
+                      extra=fields(user_id=user_session.user_id, payload=response))
 
         # Если ответ уже в виде словаря — отлично
         if isinstance(response, dict):
-            logging.info("[summarize_requirements] Ответ уже является словарём, сохраняем в сессию.")
-            user_session['response_data'] = response
+            logging.debug("[summarize_requirements] Ответ уже является словарём, сохраняем в сессию.")
+            user_session.response_data = response
             return response
 
         # Сохраняем данные как неструктурированные для дальнейшего анализа
         logging.warning("[summarize_requirements] Ответ не словарь. Сохраняем как неструктурированные данные.")
-        user_session['response_data'] = response
+        user_session.response_data = response
 
         # Переходим к обработке на втором этапе
         return {
@@ -212,18 +360,21 @@ async def summarize_requirements(messages_text, system_prompt, user_session):
 
 
 
-async def summarize_code_details(user_input, system_prompt):
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_input}
-    ]
+async def summarize_code_details(history, system_prompt, user_id=None):
+    messages = [{"role": "system", "content": system_prompt}]
+    if isinstance(history, list):
+        messages += history  # диалог из session.context
+    else:
+        messages.append({"role": "user", "content": history})
 
     try:
-        response = await call_openrouter(messages)
+        response = await call_openrouter(messages, user_id=user_id, priority=PRIORITY_CODE)
         return {
             "status": "ok",
             "reply": response
         }
+    except SchedulerBusy:
+        return {"status": "error", "reply": BUSY_REPLY}
     except Exception as e:
         logging.error(f"[summarize_code_details] Ошибка при генерации: {e}")
         return {
@@ -233,43 +384,33 @@ async def summarize_code_details(user_input, system_prompt):
 
 
 
-# 🛠 Генерация кода инструмента
-def generate_code(task, params):
-    lines = [f"# Инструмент: {task}", "# Параметры:"]
-    for k, v in params.items():
-        lines.append(f"# {k}: {v}")
-    lines.append("\nprint('Инструмент готов к работе!')")
-    return "\n".join(lines)
-
-
-# 📦 Создание ZIP-архива
-def create_zip(task, code: str):
-    zip_buffer = BytesIO()
-    with ZipFile(zip_buffer, 'w') as zip_file:
-        filename = f"{task.replace(' ', '_')}.py"
-        zip_file.writestr(filename, code)
-    zip_buffer.seek(0)
-    zip_buffer.name = f"{task.replace(' ', '_')}.zip"
-    return zip_buffer
-    
-"""Формирует скрипт, упаковывает в архив и отправляет пользователю"""
-async def send_generated_tool(message, result):
+# 📦 Проект из ответа модели в режиме кода: файлы, requirements.txt, README → архив
+async def send_generated_tool(message, result, task="Инструмент"):
     user_id = message.from_user.id
+    project = await artifact_builder.parse(result, name=task)
+    try:
+        artifact = await artifact_builder.build(project)  # сжатие в пуле потоков, повтор — из кэша
+    except ArtifactTooLarge as e:
+        logging.warning(f"[send_generated_tool] ⚠️ Архив для {user_id} не собран: {e}")
+        outbox.answer(message, f"⚠️ Не получилось собрать архив: {e}. Попробуй упростить задачу.")
+        return
 
-    # 🛠 Генерация кода на основе результата
-    task = "Скрипт инструмента"  # Можно сделать умнее — брать тему из задачи
-    params = {"Описание": result[:100]}  # Просто краткий отрывок в параметры
-    code = generate_code(task, params)
+    # ⬇️ Отправляем архив пользователю; повторная отправка того же архива — по file_id без загрузки
+    caption = f"✅ Инструмент успешно создан! Файлов: {artifact.files}"
 
-    # 📦 Создание ZIP-архива
-    zip_file = create_zip(task, code)
+    async def send():
+        if artifact.file_id:
+            return await message.answer_document(artifact.file_id, caption=caption)
+        with artifact.open() as stream:
+            sent = await message.answer_document(InputFile(stream, filename=artifact.filename), caption=caption)
+        if sent and getattr(sent, "document", None):
+            artifact.file_id = sent.document.file_id
+        return sent
 
-    # ⬇️ Отправляем архив пользователю
-    await message.answer_document(zip_file, caption="✅ Инструмент успешно создан!")
+    outbox.call(message.chat.id, send)
 
     # 🧹 Сброс режима и истории после отправки
-    user_modes[user_id] = 'chat'
-    sessions.pop(user_id, None)
+    sessions.pop(user_id)
 
 
 
@@ -277,9 +418,8 @@ async def send_generated_tool(message, result):
 @dp.message_handler(commands=["start"])
 async def send_welcome(message: types.Message):
     user_id = message.from_user.id
-    user_modes[user_id] = 'chat'
-    sessions.pop(user_id, None)
-    await message.reply("Привет! Нажми кнопку ниже, чтобы начать создание инструмента.")
+    sessions.pop(user_id)
+    outbox.answer(message, "Привет! Нажми кнопку ниже, чтобы начать создание инструмента.", reply=True)
 
 
 
@@ -289,54 +429,138 @@ async def start_command(message: types.Message):
     kb = InlineKeyboardMarkup().add(
         InlineKeyboardButton("🛠 Сделать инструмент", callback_data="make_tool")
     )
-    await message.reply("Нажми кнопку ниже, чтобы начать создание инструмента:", reply_markup=kb)
+    outbox.answer(message, "Нажми кнопку ниже, чтобы начать создание инструмента:", reply=True, reply_markup=kb)
 
 
 # 🔘 Обработка нажатия на кнопку
 @dp.callback_query_handler(lambda c: c.data == "make_tool")
 async def handle_tool_request(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
-    sessions[user_id] = {"history": [], "last_active": time.time()}  # начинаем с чистой истории и метки времени
-    await bot.send_message(user_id, "Привет! Опиши, какой инструмент тебе нужен 🧠")
+    sessions.reset(user_id)  # начинаем с чистой истории и метки времени
+    outbox.send_message(bot, user_id, GREETING_REPLY)
     await callback_query.answer()
 
 
 @dp.message_handler()
 async def handle_message(message: types.Message):
     user_id = message.from_user.id
-    user_session = user_sessions.setdefault(user_id, {"messages": [], "last_interaction": time.time()})
     text = message.text.strip().lower()
-    logging.info(f"[handle_message] 📩 Сообщение от {user_id}: {text}")
+    logging.info("[handle_message] 📩 Сообщение", extra=fields(user_id=user_id, text=text))
 
     # Получаем режим пользователя
-    mode = user_modes.get(user_id, 'chat')
-    logging.info(f"[handle_message] 🔄 Текущий режим: {mode}")
+    session = await sessions.load(user_id)
+    mode = session.mode if session else 'chat'
+    logging.debug("[handle_message] 🔄 Текущий режим", extra=fields(user_id=user_id, mode=mode))
+
+    # ⚡ Короткие реплики распознаём локально, без запроса к модели
+    intent = intent_router.classify(text)
 
     # === Подтверждение перехода на генерацию ===
     if mode == 'waiting_confirmation':
-        if text in ['готов', 'го', 'давай', 'поехали']:
-            user_modes[user_id] = 'code'
+        if intent.name == CONFIRM and intent.pure:
+            session.mode = 'code'
+            sessions.save(session)
             logging.info(f"[handle_message] ✅ Пользователь подтвердил — переходим в режим code.")
-            await message.answer("🚀 Отлично! Теперь переходим к сбору параметров и созданию инструмента.")
+            outbox.answer(message, "🚀 Отлично! Теперь переходим к сбору параметров и созданию инструмента.")
         else:
             logging.info(f"[handle_message] ⏳ Ожидаем подтверждения от {user_id}.")
-            await message.answer("✋ Напиши 'Готов', если хочешь перейти к следующему этапу.")
+            outbox.answer(message, "✋ Напиши 'Готов', если хочешь перейти к следующему этапу.")
+        return
+
+    # === Режим кода: уточнение ТЗ и сборка проекта — тоже с историей и одним запросом в полёте ===
+    if mode == 'code':
+        with timed("session_update"):
+            update_user_session(user_id, message.text.strip())
+        await coalescer.submit(user_id, message, process_code_mode)
+        return
+
+    # Пока у пользователя есть неотвеченные сообщения, порядок ответов важнее — идём обычным путём
+    if intent.pure and user_id not in coalescer and await answer_locally(message, intent, session):
         return
 
    # === Обновление истории сессии с использованием функции update_user_session ===
-    session = sessions.setdefault(user_id, {"history": [], "last_active": time.time()})
-    update_user_session(user_id, text)
-    session["last_active"] = time.time()
-    combined_history = "\n".join([msg["content"] for msg in session["history"]])
-    logging.info(f"[handle_message] 💬 История пользователя {user_id}:\n{combined_history}")
+    with timed("session_update"):
+        update_user_session(user_id, text)
+
+    # === Ответ модели: пачкой на все сообщения, пришедшие подряд ===
+    await coalescer.submit(user_id, message, answer_dialog)
+
+
+# ⚡ Ответ без модели: приветствие, благодарность, сброс, идеи из кэша. False — нужен обычный путь
+async def answer_locally(message, intent, session) -> bool:
+    user_id = message.from_user.id
+    if intent.name == GREETING:
+        outbox.answer(message, GREETING_REPLY)
+    elif intent.name == THANKS:
+        outbox.answer(message, THANKS_REPLY)
+    elif intent.name == RESTART:
+        sessions.reset(user_id)
+        outbox.answer(message, RESTART_REPLY)
+    elif intent.name == IDEAS:
+        if session is not None and len(session.context):
+            return False  # «не знаю» посреди диалога — ответ на вопрос модели, а не просьба об идеях
+        suggestions = await analyze_message(SUGGESTION_PROMPT, prompt_chat, mode="chat", cache_only=True)
+        if suggestions is None:
+            return False  # кэш ещё не прогрет
+        update_user_session(user_id, message.text.strip().lower())
+        text_response, parse_mode = format_suggestions(suggestions)
+        outbox.answer(message, text_response, parse_mode=parse_mode)
+    else:
+        return False
+    intent_router.avoided(intent.name)
+    logging.info("[answer_locally] ⚡ Ответ без модели: %s", intent.name, extra=fields(user_id=user_id, intent=intent.name))
+    return True
+
+
+# 🧠 Идеи из ответа модели (формат JSON с полем params) → текст сообщения
+def format_suggestions(suggestions):
+    ideas = (suggestions.get("params") or {}).get("вопросы")
+    if ideas and isinstance(ideas, list):
+        text_response = "🧠 Вот несколько идей:\n"
+        for idea in ideas:
+            if isinstance(idea, dict):
+                title = idea.get("название", "Без названия")
+                description = idea.get("описание", "Без описания")
+                text_response += f"\n📌 *{title}*\n{description}\n"
+            else:
+                text_response += f"\n📌 {idea}\n"
+        return text_response, "Markdown"
+    return suggestions.get("reply", "Готов обсудить идеи!"), None
+
+
+async def answer_dialog(user_id, messages):
+    with timed("answer_total", user_id):
+        await _answer_dialog(user_id, messages)
+
+
+async def _answer_dialog(user_id, messages):
+    message = messages[-1]  # отвечаем на последнее сообщение пачки
+    text = " ".join(m.text.strip().lower() for m in messages)
+    session = sessions.get(user_id)
+    if session is None:
+        return  # сессию сбросили, пока ждали
+    context = session.context
+    with timed("context_build"):
+        await context.compact()
+        dialog = context.messages()
+    logging.debug("[answer_dialog] 💬 Контекст собран", extra=fields(
+        user_id=user_id, stage="context_build", messages=len(dialog), tokens=context.last_sent_tokens))
 
 
     # === Анализ идеи ===
 
-    logging.info(f"[handle_message] ⏳ Отправка в summarize_requirements...")
-    result = await summarize_requirements(combined_history, prompt_chat, user_session)
+    logging.debug("[answer_dialog] ⏳ Отправка в summarize_requirements...")
+    progress = ProgressiveReply(message)  # ответ показывается по мере генерации
+    try:
+        result = await summarize_requirements(dialog, prompt_chat, session, on_delta=progress.update)
+    except asyncio.CancelledError:
+        await progress.discard()  # недописанный ответ устарел
+        raise
 
     reply = result.get('reply', "Не совсем понял. Можешь переформулировать?")
+    if result.get('reply') and "task" in result:  # ошибки и «занято» в историю не пишем
+        context.add("assistant", result['reply'])  # ответ модели тоже часть диалога
+        sessions.save(session)
     params = result.get('params', {})
     
     ideas = result.get('params', {}).get('вопросы', [])
@@ -347,126 +571,280 @@ async def handle_message(message: types.Message):
         elif all(isinstance(i, str) for i in ideas):
             ideas_text = "\n".join([f"📌 {i}" for i in ideas])
         else:
-            logging.warning(f"[ideas] Смешанный или нестандартный список: {ideas}")
+            logging.warning("[ideas] Смешанный или нестандартный список", extra=fields(user_id=user_id, payload=ideas))
             ideas_text = "\n".join([str(i) for i in ideas])
     elif isinstance(ideas, str):
         ideas_text = f"📌 {ideas}"
     else:
-        logging.error(f"[ideas] Неизвестный формат: {type(ideas)} | Содержимое: {ideas}")
+        logging.error("[ideas] Неизвестный формат: %s", type(ideas).__name__, extra=fields(user_id=user_id, payload=ideas))
         ideas_text = "❌ Ошибка: формат идей не распознан."
 
 
     reply_text = f"{reply}\n\n{ideas_text}" if ideas_text else reply
 
-    logging.info(f"[handle_message] 📥 Ответ анализа идеи: {result}")
+    logging.info("[answer_dialog] 📥 Ответ анализа идеи",
+                 extra=fields(user_id=user_id, status=result.get("status"), payload=result))
 
     status = result.get('status')
+    llm_status.inc(status if status in KNOWN_STATUSES else "unknown")
 
     # === Предложение перейти к следующему этапу ===
     if status == 'ready_to_start_code_phase':
-        user_modes[user_id] = 'waiting_confirmation'
-        await message.answer(f"✅ {reply} Напиши 'Готов', если хочешь перейти к сбору параметров.")
+        session.mode = 'waiting_confirmation'
+        session.goal = result.get("goal") or result.get("task") or session.goal
+        sessions.save(session)
+        await progress.finalize(f"✅ {reply} Напиши 'Готов', если хочешь перейти к сбору параметров.")
         return
 
     # === Полная готовность (альтернатива, если используешь ready_to_generate) ===
     if status == 'ready_to_generate':
-        user_modes[user_id] = 'waiting_confirmation'
-        await message.answer(f"✅ {reply} Напиши 'Готов', чтобы начать генерацию инструмента.")
+        session.mode = 'waiting_confirmation'
+        session.goal = result.get("goal") or result.get("task") or session.goal
+        sessions.save(session)
+        await progress.finalize(f"✅ {reply} Напиши 'Готов', чтобы начать генерацию инструмента.")
         return
 
     # === Юзер просит идеи ===
     if status == 'need_more_info':
         if any(kw in text for kw in ['предложи', 'идею', 'идеи', 'варианты', 'подкинь', 'не знаю']) and not result.get("params"):
-            logging.info(f"[handle_message] 🔍 Обнаружен запрос на генерацию идей от {user_id}")
+            logging.info(f"[answer_dialog] 🔍 Обнаружен запрос на генерацию идей от {user_id}")
 
-            suggestion_prompt = (
-                "Пользователь пока не определился с инструментом. "
-                "Предложи 3-5 идей полезных инструментов или скриптов на основе нейросетей или Python. "
-                "Кратко опиши назначение каждого, чтобы пользователь мог выбрать."
-            )
-            suggestions = await analyze_message(suggestion_prompt, prompt_chat, mode="chat")
-            logging.info(f"[handle_message] 💡 Идеи, предложенные пользователю:\n{suggestions}")
+            suggestions = await analyze_message(SUGGESTION_PROMPT, prompt_chat, mode="chat",
+                                                user_id=user_id, priority=PRIORITY_IDEAS)
+            logging.debug("[answer_dialog] 💡 Идеи, предложенные пользователю", extra=fields(user_id=user_id, payload=suggestions))
 
             # 🧠 Поддержка формата JSON с полем params
             if isinstance(suggestions, dict):
-                ideas = suggestions.get("params", {}).get("вопросы")
-                if ideas:
-                    text_response = "🧠 Вот несколько идей:\n"
-                    for idea in ideas:
-                        title = idea.get("название", "Без названия")
-                        description = idea.get("описание", "Без описания")
-                        text_response += f"\n📌 *{title}*\n{description}\n"
-                    await message.answer(text_response, parse_mode="Markdown")
-                else:
-                    await message.answer(suggestions.get("reply", "Готов обсудить идеи!"))
+                text_response, parse_mode = format_suggestions(suggestions)
+                await progress.finalize(text_response, parse_mode=parse_mode)
             else:
-                await message.answer(reply_text, parse_mode="Markdown")
+                await progress.finalize(reply_text, parse_mode="Markdown")
             return
 
         # Просто уточнение
-        await message.answer(reply_text, parse_mode="Markdown")
+        await progress.finalize(reply_text, parse_mode="Markdown")
         return
 
     # Неизвестный статус
-    logging.warning(f"[handle_message] ⚠️ Неизвестный статус: {status}")
-    await message.answer("⚠️ Что-то пошло не так. Попробуй переформулировать запрос.")
+    logging.warning(f"[answer_dialog] ⚠️ Неизвестный статус: {status}")
+    await progress.finalize("⚠️ Что-то пошло не так. Попробуй переформулировать запрос.")
 
 
 
 
-async def process_code_mode(message: types.Message):
-    user_id = message.from_user.id
-    text = message.text.strip()
-    logging.info(f"[process_code_mode] Обработка сообщения в режиме code от {user_id}: {text}")
-
-    # Получаем цель, сформулированную ранее
-    session = sessions.get(user_id, {})
-    goal = session.get("goal", "неизвестный инструмент")
+# 🛠 Ответ в режиме кода (через coalescer): весь диалог из session.context + цель в промпте
+async def process_code_mode(user_id, messages):
+    message = messages[-1]
+    session = sessions.get(user_id)
+    if session is None:
+        return  # сессию сбросили, пока ждали
+    logging.info("[process_code_mode] Обработка сообщения в режиме code",
+                 extra=fields(user_id=user_id, messages=len(messages)))
 
+    # Цель, сформулированная моделью в конце режима чата
+    goal = session.goal or "неизвестный инструмент"
     prompt = prompt_code.replace("<<GOAL>>", goal)
 
-    result = await summarize_code_details(text, prompt)
-    reply = result.get("reply", "Что-то пошло не так при составлении ТЗ.")
+    context = session.context
+    with timed("context_build"):
+        await context.compact()
+        dialog = context.messages()
 
-    await message.answer(reply)
-    logging.info(f"[process_code_mode] Ответ отправлен пользователю {user_id}")
+    result = await summarize_code_details(dialog, prompt, user_id=user_id)
+    reply = result.get("reply") or "Что-то пошло не так при составлении ТЗ."
+    if result.get("status") != "ok":
+        outbox.answer(message, reply)  # ошибки и «занято» в историю не пишем
+        return
+
+    # Модель прислала код — собираем из него проект; иначе это ещё уточнение ТЗ
+    if "```" in reply:
+        await send_generated_tool(message, reply, task=goal)
+        return
+    context.add("assistant", reply)
+    sessions.save(session)
+    outbox.answer(message, reply)
+    logging.info("[process_code_mode] Ответ отправлен", extra=fields(user_id=user_id))
 
         
 
+# 🔥 Прогрев кэша идеями: запрос "предложи идеи" не ходит в модель
+async def prewarm_suggestions():
+    while True:
+        result = await analyze_message(SUGGESTION_PROMPT, prompt_chat, mode="chat", refresh_cache=True,
+                                       priority=PRIORITY_BACKGROUND)
+        warmed = "task" in result  # ошибки не кэшируются и приходят без task
+        logging.info(f"[prewarm_suggestions] 🔥 Идеи в кэше: {warmed} | {response_cache.stats()}")
+        # Обновляем до истечения TTL, а при ошибке пробуем снова через минуту
+        await asyncio.sleep(max(LLM_CACHE_TTL * 0.9, 60) if warmed else 60)
+
+
+
 # 🧹 АВТООЧИСТКА СЕССИЙ
 async def cleanup_sessions():
     while True:
-        now = time.time()
-        to_delete = []
+        for user_id in sessions.expire():
+            logging.info(f"🗑️ Удалена сессия пользователя {user_id} из-за неактивности.")
+        removed = await sessions.expire_stored()
+        if removed:
+            logging.info(f"🗑️ Удалено {removed} сохранённых сессий без активности.")
+        log_stats(sessions)
+        log_snapshot()
+        await asyncio.sleep(SESSION_CLEANUP_INTERVAL)
 
-        for user_id, session in list(sessions.items()):
-            if now - session["last_active"] > 3600:  # 1 час неактивности
-                to_delete.append(user_id)
 
-        for user_id in to_delete:
-            sessions.pop(user_id, None)
-            logging.info(f"🗑️ Удалена сессия пользователя {user_id} из-за неактивности.")
-        await asyncio.sleep(600)  # каждые 10 мин
+
+# 🚀 Сервисы процесса, который сам обрабатывает апдейты
+async def start_services():
+    init_http_client()  # общий пул соединений для OpenRouter и пинга
+    sessions.backend = create_backend()  # сессии переживают перезапуск
+    await sessions.backend.start()
+    asyncio.create_task(cleanup_sessions())  # автоочистка
+    if LLM_CACHE_ENABLED and LLM_CACHE_PREWARM:
+        asyncio.create_task(prewarm_suggestions())
+
+
+async def stop_services():
+    await updates.drain()  # доделываем принятые апдейты
+    await outbox.drain()  # отправляем то, что уже в очереди
+    artifact_builder.close()  # временные архивы на диске
+    await sessions.close()  # дописываем отложенные изменения
+    await close_http_client()
+    await (await bot.get_session()).close()
+    shutdown_logging()  # дописываем очередь логов
 
 
+# Render присылает SIGTERM при редеплое — завершаемся аккуратно
+def stop_on_signals() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
 
-# 🌐 Flask-сервер для Render
-@app.route("/")
-def index():
-    return "ToolBot работает!"
+
+async def set_webhook():
+    await bot.set_webhook(WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+    logging.info(f"[main] 📨 Webhook установлен: {WEBHOOK_HOST}{WEBHOOK_PATH}")
 
 
 # 🚀 Главная точка входа
 async def main():
-    asyncio.create_task(cleanup_sessions())  # автоочистка
+    if BOT_WORKERS > 1:
+        await run_router()
+        return
+
+    await start_services()
+    asyncio.create_task(ping_render())
+    stop = stop_on_signals()
+    runner = await start_web_app(app)
+    polling = None
+    try:
+        if BOT_MODE == "webhook":
+            await set_webhook()
+        else:
+            # Локальная разработка: long polling в том же event loop
+            await bot.delete_webhook()
+            polling = asyncio.create_task(dp.start_polling())
+            polling.add_done_callback(lambda _: stop.set())
+        await stop.wait()
+    finally:
+        if polling is not None:
+            dp.stop_polling()
+            await asyncio.wait([polling], timeout=5)
+        await runner.cleanup()
+        await stop_services()
+
+
+# 🔀 Приёмник при BOT_WORKERS > 1: принимает апдейты и раскладывает их по воркерам (workers.py)
+async def run_router():
+    if not SESSION_DB_PATH:
+        logging.warning("[main] ⚠️ SESSION_DB_PATH пуст: при перестройке кольца сессии переехавших пользователей потеряются")
+    router = Router(run_worker, BOT_WORKERS)
+    # Сессии, очереди и этапы живут в воркерах: вместо нулей из простаивающих объектов приёмника
+    # отдаём снимки воркеров (пульс в реестре) с меткой worker
+    metrics.clear()
+    metrics.register(metrics.Remote("worker", lambda: router.worker_metrics))
+    metrics.gauge("toolbot_workers_alive", "Воркеры в кольце", lambda: len(router.ring.nodes))
+    metrics.counter_func("toolbot_router_total", "Апдейты приёмника и перестройки кольца", lambda: router.stats,
+                         labels=("kind",))
+    metrics.gauge("toolbot_router_buffer", "Апдейты в буфере на время перестройки кольца", lambda: len(router.buffer))
+
+    init_http_client()  # только для пинга: запросы к модели делают воркеры
     asyncio.create_task(ping_render())
-    await dp.start_polling()
+    await router.start()
+    stop = stop_on_signals()
+    runner = await start_web_app(create_web_app(router))
+    polling = None
+    try:
+        if BOT_MODE == "webhook":
+            await set_webhook()
+        else:
+            await bot.delete_webhook()
+            polling = asyncio.create_task(router.poll(bot))
+            polling.add_done_callback(lambda _: stop.set())
+        await stop.wait()
+    finally:
+        if polling is not None:
+            polling.cancel()
+        await runner.cleanup()
+        await router.stop()  # воркеры доделывают свои апдейты сами
+        await close_http_client()
+        await (await bot.get_session()).close()
+        shutdown_logging()
+
+
+# 🧵 Процесс-воркер: свой event loop, свои пулы и очереди; апдейты приходят от приёмника
+def run_worker(worker_id, inbox, control):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C ловит приёмник и останавливает воркеры сам
+    asyncio.run(worker_main(worker_id, inbox, control))
+
+
+# Апдейты воркера в обработке по пользователям: при передаче пользователя их доделывают до выгрузки сессии
+worker_updates = {}
+
+
+def submit_worker_update(data):
+    user_id = update_user_id(data)
+    task = updates.submit(types.Update(**data))
+    worker_updates.setdefault(user_id, set()).add(task)
+    task.add_done_callback(lambda done: _forget_worker_update(user_id, done))
+
+
+def _forget_worker_update(user_id, task):
+    tasks = worker_updates.get(user_id)
+    if tasks is not None:
+        tasks.discard(task)
+        if not tasks:
+            del worker_updates[user_id]
+
+
+# 🔀 Пользователи переехали: сначала доотвечаем или отменяем их ответы, потом отдаём сессии.
+# Иначе старый воркер ответил бы параллельно с новым и перезаписал бы его сессию в общей базе.
+# Апдейт, принятый до перестройки, мог ещё не дойти до coalescer — его тоже ждём, а не успевший — отменяем
+async def release_users(keep):
+    step = WORKER_HANDOFF_TIMEOUT / 3
+    moving = [task for user_id, tasks in worker_updates.items() if not keep(user_id) for task in tasks]
+    if moving:
+        await asyncio.wait(moving, timeout=step)
+    await coalescer.release(keep, timeout=step)
+    late = [task for task in moving if not task.done()]
+    for task in late:
+        task.cancel()
+    if late:
+        await asyncio.wait(late)
+        logging.warning(f"[main] ✂️ При передаче пользователей отменено апдейтов: {len(late)}")
+    return await sessions.release(keep)
+
+
+async def worker_main(worker_id, inbox, control):
+    await start_services()
+    logging.info(f"[main] 🧵 Воркер {worker_id} запущен (pid {os.getpid()})")
+    try:
+        link = WorkerLink(worker_id, inbox, control)
+        await link.run(submit=submit_worker_update, release=release_users)
+    finally:
+        await stop_services()
 
-def run_flask():
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
 if __name__ == "__main__":
-    Thread(target=run_flask).start()  # запуск Flask в фоне
-    asyncio.run(main())  # запуск aiogram как основной задачи
-
-
+    asyncio.run(main())
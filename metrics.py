@@ -0,0 +1,210 @@
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from logs import fields
+
+# 📈 Метрики в текстовом формате Prometheus без сторонних зависимостей.
+# Запись — пара сложений; всё остальное (gauge, форматирование) считается только при опросе /metrics.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [counts по корзинам..., sum, count]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + ('+Inf',))} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}"
+
+
+# Gauge считается функцией только в момент опроса; функция возвращает число или {метки: число}
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labels=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.label_names = tuple(labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        value = self.func()
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                yield f"{self.name}{_labels(self.label_names, labels)} {item}"
+        else:
+            yield f"{self.name} {value}"
+
+
+# Счётчик, который уже ведёт сам модуль (stats-словари): читается при опросе, как gauge, но только растёт
+class CounterFunc(Gauge):
+    kind = "counter"
+
+
+_registry = []
+
+
+def counter(name, help_text, labels=()):
+    metric = Counter(name, help_text, labels)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, help_text, labels, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name, help_text, func, labels=()):
+    metric = Gauge(name, help_text, func, labels)
+    _registry.append(metric)
+    return metric
+
+
+def counter_func(name, help_text, func, labels=()):
+    metric = CounterFunc(name, help_text, func, labels)
+    _registry.append(metric)
+    return metric
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+# Убираем всё зарегистрированное: приёмнику при нескольких воркерах свои «пустые» метрики процесса не нужны
+def clear():
+    _registry.clear()
+
+
+# [(имя, строки HELP/TYPE, строки значений)]; сборщик с families() отдаёт сразу несколько семейств
+def _families(metric):
+    if hasattr(metric, "families"):
+        return metric.families()
+    lines = list(metric.render())
+    return [(metric.name, lines[:2], lines[2:])]
+
+
+# 📦 Снимок для передачи в другой процесс (JSON-совместимый)
+def export() -> list:
+    return [family for metric in _registry for family in _families(metric)]
+
+
+def render() -> str:
+    # Одно семейство может прийти из нескольких источников (воркеры) — HELP/TYPE выводим один раз
+    families = {}
+    for metric in _registry:
+        for name, header, samples in _families(metric):
+            families.setdefault(name, (header, []))[1].extend(samples)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# Метрики других процессов: source() → {значение метки: export()}, к каждой серии добавляется метка
+class Remote:
+    def __init__(self, label, source):
+        self.label = label
+        self.source = source
+
+    def families(self):
+        result = []
+        for value, families in self.source().items():
+            extra = f'{self.label}="{_escape(value)}"'
+            for name, header, samples in families:
+                result.append((name, header, [_add_label(line, extra) for line in samples]))
+        return result
+
+
+def _add_label(line, extra) -> str:
+    series, _, value = line.rpartition(" ")
+    if series.endswith("}"):
+        return f"{series[:-1]},{extra}}} {value}"
+    return f"{series}{{{extra}}} {value}"
+
+
+# 📊 Общие метрики бота
+stage_latency = histogram("toolbot_stage_seconds", "Время этапов обработки сообщения", labels=("stage",))
+llm_status = counter("toolbot_llm_status_total", "Статусы ответов модели", labels=("status",))
+llm_tokens = counter("toolbot_llm_tokens_total", "Токены по полю usage ответа OpenRouter", labels=("model", "kind"))
+
+
+@contextmanager
+def timed(stage, user_id=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        stage_latency.observe(duration, stage)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("[timed] ⏱ Этап завершён",
+                          extra=fields(user_id=user_id, stage=stage, duration_ms=round(duration * 1000, 2)))
+
+
+def record_usage(model, usage):
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if isinstance(value, (int, float)):
+            llm_tokens.inc(model or "unknown", kind[:-len("_tokens")], amount=value)
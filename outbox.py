@@ -0,0 +1,246 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import deque
+
+from aiogram.utils.exceptions import RetryAfter, MessageNotModified
+
+# ⚙️ Лимиты Telegram на исходящие сообщения
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))  # сообщений в секунду на бота (лимит Telegram — 30)
+TG_GLOBAL_BURST = int(os.getenv("TG_GLOBAL_BURST", "5"))  # rate + burst не больше 30 за любую секунду
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))  # сообщений в секунду в один чат
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_MESSAGE_LIMIT = 4096  # символов в одном сообщении
+TG_ACK_MAX_CHARS = int(os.getenv("TG_ACK_MAX_CHARS", "200"))  # короче — идёт вне очереди длинных ответов
+TG_SEND_RETRIES = int(os.getenv("TG_SEND_RETRIES", "3"))  # повторов после RetryAfter
+
+PRIORITY_ACK = 0     # короткие подтверждения
+PRIORITY_NORMAL = 1  # ответы модели, документы
+
+
+# 🪣 Корзина токенов: rate в секунду, не больше burst подряд
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # Сколько ждать до свободного токена
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        if self.updated > now:
+            return self.updated - now  # пауза после RetryAfter
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.tokens = 0.0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+# 🚦 Общий лимит бота: токены раздаются ожидающим по приоритету, затем по очереди
+class PriorityLimiter:
+    def __init__(self, rate=TG_GLOBAL_RATE, burst=TG_GLOBAL_BURST):
+        self.bucket = TokenBucket(rate, burst)
+        self._waiters = []  # (priority, seq, future)
+        self._seq = 0
+        self._timer = None
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        if not self._waiters and self.bucket.wait_time() == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        if self._timer is None:
+            self._wake()
+        await future  # отменённые ожидающие пропускаются в _wake
+
+    # 429 бывает и общим (flood на весь бот): остальные чаты тоже ждут, а не ловят 429 следом
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+    def _wake(self):
+        self._timer = None
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._wake)
+                return
+            heapq.heappop(self._waiters)
+            self.bucket.take()
+            future.set_result(None)
+
+    def __len__(self):
+        return len(self._waiters)
+
+
+# ✂️ Длинный текст режется по абзацам, строкам, пробелам — в крайнем случае посередине слова
+def split_message(text: str, limit=TG_MESSAGE_LIMIT) -> list:
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, limit // 2, limit)
+            if cut != -1:
+                break
+        if cut == -1:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+class _Job:
+    __slots__ = ("call", "priority", "future")
+
+    def __init__(self, call, priority, future):
+        self.call = call
+        self.priority = priority
+        self.future = future
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "task")
+
+    def __init__(self, rate, burst):
+        self.jobs = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.task = None
+
+
+def _consume(future):
+    # Ответы «отправил и забыл»: ошибка уже в логе, предупреждение asyncio не нужно
+    if not future.cancelled():
+        future.exception()
+
+
+# 📤 Исходящие в Telegram: порядок внутри чата, лимиты чата и бота, повторы после RetryAfter
+class Outbox:
+    def __init__(self, chat_rate=TG_CHAT_RATE, chat_burst=TG_CHAT_BURST, limiter=None):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.limiter = limiter or PriorityLimiter()
+        self._chats = {}
+        self.stats = {"sent": 0, "split": 0, "retry_after": 0, "failed": 0}
+
+    # Любой вызов Bot API: call() — корутина без аргументов. Возвращает future с её результатом
+    def call(self, chat_id, call, priority=PRIORITY_NORMAL) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        chat.jobs.append(_Job(call, priority, future))
+        if chat.task is None:
+            chat.task = asyncio.create_task(self._drain_chat(chat_id, chat))
+        return future
+
+    # Текст любой длины: части уходят подряд, клавиатура — у последней. Future — последнее сообщение
+    def answer(self, message, text, priority=None, **kwargs) -> asyncio.Future:
+        return self._send_text(message.chat.id, message.answer, text, priority, kwargs)
+
+    def send_message(self, bot, chat_id, text, priority=None, **kwargs) -> asyncio.Future:
+        return self._send_text(chat_id, lambda part, **kw: bot.send_message(chat_id, part, **kw), text, priority, kwargs)
+
+    def _send_text(self, chat_id, send, text, priority, kwargs):
+        if priority is None:
+            priority = PRIORITY_ACK if len(text) <= TG_ACK_MAX_CHARS else PRIORITY_NORMAL
+        parts = split_message(text)
+        if len(parts) > 1:
+            self.stats["split"] += 1
+            logging.info(f"[Outbox] ✂️ Ответ в чат {chat_id} разбит на {len(parts)} сообщения")
+        markup = kwargs.pop("reply_markup", None)
+        future = None
+        for index, part in enumerate(parts):
+            extra = dict(kwargs, reply_markup=markup) if markup is not None and index == len(parts) - 1 else kwargs
+            future = self.call(chat_id, lambda part=part, extra=extra: send(part, **extra), priority)
+        return future
+
+    async def _drain_chat(self, chat_id, chat):
+        while chat.jobs:
+            job = chat.jobs.popleft()
+            if job.future.cancelled():
+                continue
+            await self._run(chat_id, chat, job)
+        chat.task = None
+        # Корзину чата держим, пока она не наполнится: иначе следующий ответ получил бы лишний запас
+        asyncio.get_running_loop().call_later(self.chat_burst / self.chat_rate, self._forget, chat_id, chat)
+
+    async def _run(self, chat_id, chat, job):
+        for attempt in range(TG_SEND_RETRIES + 1):
+            wait = chat.bucket.wait_time()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = chat.bucket.wait_time()
+            chat.bucket.take()
+            await self.limiter.acquire(job.priority)
+            if job.future.cancelled():
+                return  # ответ устарел, пока ждал очереди
+            try:
+                result = await job.call()
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                logging.warning(f"[Outbox] ⏳ Telegram просит подождать {e.timeout} с (чат {chat_id}, попытка {attempt + 1})")
+                chat.bucket.pause(e.timeout)
+                self.limiter.pause(e.timeout)
+                if attempt < TG_SEND_RETRIES:
+                    continue
+                self._fail(job, e)
+                return
+            except Exception as e:
+                self._fail(job, e)
+                return
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+            return
+
+    def _fail(self, job, error):
+        if not isinstance(error, MessageNotModified):  # правка без изменений — не ошибка
+            self.stats["failed"] += 1
+            logging.warning(f"[Outbox] ❌ Не удалось отправить: {type(error).__name__}: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _forget(self, chat_id, chat):
+        if self._chats.get(chat_id) is not chat or chat.task is not None:
+            return  # чат снова занят — таймер поставит следующий выход из _drain_chat
+        if chat.bucket.full():
+            del self._chats[chat_id]
+        else:
+            asyncio.get_running_loop().call_later(1 / self.chat_rate, self._forget, chat_id, chat)
+
+    def queued(self) -> int:
+        return sum(len(chat.jobs) for chat in self._chats.values())
+
+    # Дожидаемся отправки при остановке
+    async def drain(self, timeout=10):
+        tasks = [chat.task for chat in self._chats.values() if chat.task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+outbox = Outbox()
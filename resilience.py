@@ -0,0 +1,263 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+# ⚙️ Повторы, хеджирование, предохранитель и запасные модели для OpenRouter
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv(
+    "LLM_FALLBACK_MODELS", "google/gemma-3-12b-it,meta-llama/llama-3.3-70b-instruct"
+).split(",") if m.strip()]
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # повторов на модель после первой попытки
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "10"))  # дольше ждать не будем — берём другую модель
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "45"))  # медленнее — сразу следующая модель
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "90"))  # на весь запрос со всеми повторами и моделями
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))  # пока мало замеров для p95
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # подряд, чтобы разомкнуть
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))  # секунд до пробного запроса
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# Сбой модели, а не запроса: сеть, таймаут, 429/5xx. 4xx (ключ, формат запроса) предохранитель не трогает
+def is_model_failure(error) -> bool:
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in RETRYABLE_STATUSES
+
+
+# 🔌 Предохранитель: после серии ошибок модель временно не трогаем
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True  # пропускаем один пробный запрос
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+# ⏱ Скользящее окно задержек для порога хеджирования
+class LatencyTracker:
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self.samples) < 20:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def retry_after_seconds(response: httpx.Response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# 🛡 Надёжный POST в OpenRouter
+class ResilientLLM:
+    def __init__(self, fallback_models=None, max_retries=LLM_MAX_RETRIES, hedging=LLM_HEDGING,
+                 attempt_timeout=LLM_ATTEMPT_TIMEOUT, total_timeout=LLM_TOTAL_TIMEOUT):
+        self.fallback_models = LLM_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self.max_retries = max_retries
+        self.hedging = hedging
+        self.attempt_timeout = attempt_timeout
+        self.total_timeout = total_timeout
+        self.breakers = {}
+        self.latency = {}
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                      "fallbacks": 0, "short_circuits": 0, "failures": 0}
+
+    def breaker(self, model) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+
+    def _tracker(self, model) -> LatencyTracker:
+        if model not in self.latency:
+            self.latency[model] = LatencyTracker()
+        return self.latency[model]
+
+    def hedge_delay(self, model) -> float:
+        p95 = self._tracker(model).percentile(0.95)
+        return max(LLM_HEDGE_MIN_DELAY, p95) if p95 is not None else LLM_HEDGE_DEFAULT_DELAY
+
+    def backoff(self, attempt) -> float:
+        # «Полный джиттер»: случайная пауза до экспоненциального предела
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    # deadline (time.monotonic()) — если часть общего бюджета уже потрачена, например на стрим
+    async def post(self, client, url, payload, headers, deadline=None) -> httpx.Response:
+        self.stats["requests"] += 1
+        models = [payload["model"]] + [m for m in self.fallback_models if m != payload["model"]]
+        last_error = None
+        if deadline is None:
+            deadline = time.monotonic() + self.total_timeout
+
+        for index, model in enumerate(models):
+            if time.monotonic() >= deadline:
+                logging.warning(f"[ResilientLLM] ⏱ Исчерпан общий бюджет {self.total_timeout:.0f} с на запрос")
+                last_error = last_error or httpx.TimeoutException(
+                    f"OpenRouter: нет ответа за {self.total_timeout:.0f} с")
+                break
+            breaker = self.breaker(model)
+            if not breaker.allow():
+                self.stats["short_circuits"] += 1
+                logging.warning(f"[ResilientLLM] 🔌 {model} временно отключена предохранителем")
+                continue
+            if index > 0:
+                self.stats["fallbacks"] += 1
+                logging.warning(f"[ResilientLLM] 🔀 Переходим на запасную модель {model}")
+            body = dict(payload, model=model)
+
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if attempt:
+                    self.stats["retries"] += 1
+                try:
+                    response = await asyncio.wait_for(self._send(client, url, body, headers, model), remaining)
+                except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+                    # Модель медленная — повтор на ней же стоил бы ещё столько же, берём следующую
+                    breaker.record_failure()
+                    last_error = e if isinstance(e, httpx.TimeoutException) else httpx.TimeoutException(
+                        f"OpenRouter: нет ответа за {self.total_timeout:.0f} с")
+                    logging.warning(f"[ResilientLLM] ⏱ {model}: таймаут, попытка {attempt + 1}")
+                    break
+                except httpx.TransportError as e:
+                    breaker.record_failure()
+                    last_error = e
+                    logging.warning(f"[ResilientLLM] ⚠️ {model}: {type(e).__name__}, попытка {attempt + 1}")
+                    if attempt < self.max_retries and breaker.allow():
+                        await asyncio.sleep(min(self.backoff(attempt), max(0.0, deadline - time.monotonic())))
+                        continue
+                    break
+
+                if response.status_code not in RETRYABLE_STATUSES:
+                    if response.is_success:
+                        breaker.record_success()
+                    response.raise_for_status()  # 4xx — повтор не поможет
+                    return response
+
+                breaker.record_failure()
+                last_error = httpx.HTTPStatusError(
+                    f"OpenRouter {response.status_code}", request=response.request, response=response
+                )
+                wait = retry_after_seconds(response)
+                logging.warning(f"[ResilientLLM] ⚠️ {model}: HTTP {response.status_code}, попытка {attempt + 1}"
+                                f"{f', Retry-After {wait:.1f} с' if wait is not None else ''}")
+                if wait is not None and wait > LLM_RETRY_AFTER_MAX:
+                    break  # долго ждать — пробуем следующую модель
+                pause = wait if wait is not None else self.backoff(attempt)
+                if attempt < self.max_retries and breaker.allow() and time.monotonic() + pause < deadline:
+                    await asyncio.sleep(pause)
+                    continue
+                break
+
+        self.stats["failures"] += 1
+        if last_error is None:
+            raise CircuitOpen("все модели временно отключены предохранителем")
+        raise last_error
+
+    async def _send(self, client, url, body, headers, model) -> httpx.Response:
+        started = time.monotonic()
+
+        async def attempt():
+            return await client.post(url, json=body, headers=headers, timeout=self.attempt_timeout)
+
+        if not self.hedging:
+            response = await attempt()
+        else:
+            response = await self._hedged(attempt, self.hedge_delay(model))
+        if response.is_success:
+            self._tracker(model).add(time.monotonic() - started)
+        return response
+
+    # 🏁 Второй запрос, если первый не успел за p95; берём первый удачный
+    async def _hedged(self, attempt, delay):
+        first = asyncio.create_task(attempt())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+
+            self.stats["hedges"] += 1
+            second = asyncio.create_task(attempt())
+            tasks.append(second)
+            pending = set(tasks)
+            outcome = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUSES:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    outcome = task
+            return outcome.result()  # обе неудачны — отдаём последнюю ошибку
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "breakers": {model: breaker.state for model, breaker in self.breakers.items()},
+        }
+
+
+openrouter_resilience = ResilientLLM()
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# ⚙️ Хранение сессий между перезапусками
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")  # пустая строка — только память
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", "500"))
+SESSION_SNAPSHOT_CHUNK = int(os.getenv("SESSION_SNAPSHOT_CHUNK", "10"))  # снимков подряд, потом event loop свободен
+
+
+# 🧩 Базовый бэкенд: ничего не хранит (сессии живут только в памяти)
+class SessionBackend:
+    async def start(self):
+        pass
+
+    async def load(self, user_id):
+        return None
+
+    # session — объект с методом to_dict(); запись может быть отложенной
+    def save(self, user_id, session):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+    # Удаление записей, не обновлявшихся с момента older_than
+    async def purge(self, older_than):
+        return 0
+
+    # Дописать отложенные изменения прямо сейчас
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+# 💾 SQLite (WAL) с отложенной пакетной записью в отдельном потоке.
+# Чтение — своим соединением в своём потоке: первое сообщение после перезапуска не ждёт пакетную запись
+class SQLiteSessionBackend(SessionBackend):
+    def __init__(self, path=SESSION_DB_PATH, flush_interval=SESSION_FLUSH_INTERVAL, batch_size=SESSION_FLUSH_BATCH,
+                 snapshot_chunk=SESSION_SNAPSHOT_CHUNK):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.snapshot_chunk = snapshot_chunk
+        # Один поток — одно соединение: sqlite не любит общий коннект между потоками
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db-read")
+        self._conn = None
+        self._reader = None
+        self._pending = {}  # user_id -> session или None (удаление); повторные записи склеиваются
+        self._writing = {}  # user_id -> JSON-снимок или None: уже снято, но ещё не на диске
+        self._flush_lock = asyncio.Lock()  # пакеты пишутся по очереди, иначе старый снимок лёг бы поверх нового
+        self._wakeup = asyncio.Event()
+        self._flusher = None
+        self.writes = 0
+        self.flushes = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+        self._conn = conn
+
+    def _connect_reader(self):
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+
+    async def start(self):
+        await self._run(self._connect)
+        await asyncio.get_running_loop().run_in_executor(self._read_executor, self._connect_reader)
+        self._flusher = asyncio.create_task(self._flush_loop())
+        logging.info(f"[SQLiteSessionBackend] 💾 Сессии сохраняются в {self.path}")
+
+    def _load(self, user_id):
+        row = self._reader.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def load(self, user_id):
+        if user_id in self._pending:
+            session = self._pending[user_id]
+            return session.to_dict() if session is not None else None
+        if user_id in self._writing:
+            data = self._writing[user_id]
+            return json.loads(data) if data is not None else None
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, self._load, user_id)
+
+    def save(self, user_id, session):
+        self._pending[user_id] = session
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def delete(self, user_id):
+        self._pending[user_id] = None
+
+    def _purge(self, older_than):
+        with self._conn:
+            return self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+
+    async def purge(self, older_than):
+        return await self._run(self._purge, older_than)
+
+    def _write(self, upserts, deletes):
+        now = time.time()
+        rows = [(user_id, data, now) for user_id, data in upserts]
+        with self._conn:
+            if rows:
+                self._conn.executemany(
+                    "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    rows,
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(u,) for u in deletes])
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            # Снимок и JSON — в event loop небольшими порциями, в потоке остаётся только диск:
+            # json.dumps в потоке держал бы GIL и тормозил loop сильнее, чем короткие порции здесь
+            items = list(pending.items())
+            for start in range(0, len(items), self.snapshot_chunk):
+                for user_id, session in items[start:start + self.snapshot_chunk]:
+                    self._writing[user_id] = (
+                        json.dumps(session.to_dict(), ensure_ascii=False) if session is not None else None
+                    )
+                await asyncio.sleep(0)
+            upserts = [(user_id, data) for user_id, data in self._writing.items() if data is not None]
+            deletes = [user_id for user_id, data in self._writing.items() if data is None]
+            try:
+                await self._run(self._write, upserts, deletes)
+                self.writes += len(pending)
+                self.flushes += 1
+            except Exception as e:
+                logging.error(f"[SQLiteSessionBackend] ❌ Ошибка записи сессий: {e}")
+                # Не теряем изменения: вернём их, если новых поверх не пришло
+                for user_id, session in pending.items():
+                    self._pending.setdefault(user_id, session)
+            finally:
+                self._writing = {}
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        if self._reader is not None:
+            await asyncio.get_running_loop().run_in_executor(self._read_executor, self._reader.close)
+            self._reader = None
+        self._executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+
+
+def create_backend():
+    if SESSION_DB_PATH:
+        return SQLiteSessionBackend(SESSION_DB_PATH)
+    return SessionBackend()
@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+import heapq
+import random
+import logging
+
+from session_backend import SessionBackend
+
+# ⚙️ Время жизни сессии без активности (секунды)
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_CLEANUP_INTERVAL = float(os.getenv("SESSION_CLEANUP_INTERVAL", "60"))
+
+
+# 👤 Всё состояние пользователя в одном компактном объекте
+class UserSession:
+    __slots__ = ("user_id", "_mode", "_by_mode", "context", "goal", "response_data", "created_at", "last_active")
+
+    def __init__(self, user_id, context):
+        now = time.time()
+        self.user_id = user_id
+        self._by_mode = None  # счётчики режимов хранилища, пока сессия в нём
+        self._mode = "chat"  # 'chat', 'waiting_confirmation' или 'code'
+        self.context = context
+        self.goal = None
+        self.response_data = None
+        self.created_at = now
+        self.last_active = now
+
+    # Смена режима сразу правит счётчики хранилища: сессии по режимам считаются без обхода
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        by_mode = self._by_mode
+        if by_mode is not None and value != self._mode:
+            by_mode[self._mode] -= 1
+            by_mode[value] = by_mode.get(value, 0) + 1
+        self._mode = value
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "goal": self.goal,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "context": self.context.to_dict(),
+        }
+
+    def restore(self, data: dict):
+        self.mode = data.get("mode", "chat")
+        self.goal = data.get("goal")
+        self.created_at = data.get("created_at", self.created_at)
+        self.last_active = data.get("last_active", self.last_active)
+        self.context.restore(data.get("context", {}))
+
+
+# 🗂 Хранилище сессий с истечением через кучу (heap)
+class SessionStore:
+    def __init__(self, context_factory, ttl=SESSION_TTL, backend=None):
+        self.context_factory = context_factory
+        self.ttl = ttl
+        self.backend = backend or SessionBackend()
+        self._sessions = {}
+        # (момент истечения, user_id) — по одной записи на сессию;
+        # при продлении запись не трогаем, а переставляем, когда она всплывёт
+        self._heap = []
+        self._by_mode = {}
+        self.expired_total = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    # Чтение без создания (в отличие от старого defaultdict)
+    def get(self, user_id):
+        return self._sessions.get(user_id)
+
+    # Ленивая подгрузка с диска при первом сообщении после перезапуска
+    async def load(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is not None:
+            return session
+        data = await self.backend.load(user_id)
+        if not data or data.get("last_active", 0) + self.ttl <= time.time():
+            return None
+        session = self._sessions.get(user_id)
+        if session is None:  # пока читали диск, сессию могли создать
+            session = UserSession(user_id, self.context_factory())
+            session.restore(data)
+            self._add(session)
+        return session
+
+    def get_or_create(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._create(user_id)
+        return session
+
+    # Новая чистая сессия вместо старой
+    def reset(self, user_id):
+        self._remove(user_id)
+        session = self._create(user_id)
+        self.save(session)
+        return session
+
+    def pop(self, user_id):
+        self.backend.delete(user_id)
+        return self._remove(user_id)
+
+    # 🔀 Пользователи переехали на другой воркер: выгружаем из памяти и дописываем изменения на диск
+    async def release(self, keep):
+        released = [user_id for user_id in self._sessions if not keep(user_id)]
+        for user_id in released:
+            self.backend.save(user_id, self._remove(user_id))
+        await self.backend.flush()
+        return released
+
+    def touch(self, session):
+        session.last_active = time.time()
+
+    # 💾 Отложенная запись изменений сессии. Сессию, которую уже сбросили или удалили, не пишем:
+    # иначе ответ, догенерированный по старой сессии, вернул бы её историю и режим
+    def save(self, session):
+        if self._sessions.get(session.user_id) is not session:
+            return
+        self.backend.save(session.user_id, session)
+
+    def _create(self, user_id):
+        session = UserSession(user_id, self.context_factory())
+        self._add(session)
+        return session
+
+    def _add(self, session):
+        self._sessions[session.user_id] = session
+        heapq.heappush(self._heap, (session.last_active + self.ttl, session.user_id))
+        session._by_mode = self._by_mode
+        self._by_mode[session.mode] = self._by_mode.get(session.mode, 0) + 1
+
+    def _remove(self, user_id):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._by_mode[session.mode] -= 1
+            session._by_mode = None  # дальнейшие изменения старой сессии счётчики не трогают
+        return session
+
+    # 🧹 Удаление истёкших: O(log n) на каждую всплывшую запись, без полного обхода
+    def expire(self, now=None):
+        now = now or time.time()
+        removed = []
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id = heapq.heappop(self._heap)
+            session = self._sessions.get(user_id)
+            if session is None:
+                continue  # сессию уже удалили вручную
+            expires_at = session.last_active + self.ttl
+            if expires_at > now:
+                # Пользователь был активен — переносим запись на новый срок
+                heapq.heappush(self._heap, (expires_at, user_id))
+                continue
+            self._remove(user_id)
+            self.backend.delete(user_id)
+            removed.append(user_id)
+        # Записи удалённых вручную сессий копятся в куче — изредка пересобираем её
+        if len(self._heap) > 2 * len(self._sessions) + 1024:
+            self._heap = [(s.last_active + self.ttl, uid) for uid, s in self._sessions.items()]
+            heapq.heapify(self._heap)
+        self.expired_total += len(removed)
+        return removed
+
+    # Чистка сохранённых сессий тех, кто так и не вернулся после перезапуска
+    async def expire_stored(self):
+        return await self.backend.purge(time.time() - self.ttl)
+
+    async def close(self):
+        await self.backend.close()
+
+    def count_by_mode(self) -> dict:
+        return {mode: count for mode, count in self._by_mode.items() if count}
+
+    # 📊 Количество сессий, режимы и примерная память (по выборке).
+    # Выборка — из кучи (это уже список), а не из копии всего словаря: O(sample_size) при любом числе сессий
+    def stats(self, sample_size=200) -> dict:
+        by_mode = self.count_by_mode()
+        sample = []
+        if self._heap:
+            for _, user_id in random.sample(self._heap, min(sample_size, len(self._heap))):
+                session = self._sessions.get(user_id)
+                if session is not None:
+                    sample.append(session)
+        per_session = sum(_session_size(s) for s in sample) / len(sample) if sample else 0
+        return {
+            "sessions": len(self._sessions),
+            "by_mode": by_mode,
+            "heap_entries": len(self._heap),
+            "expired_total": self.expired_total,
+            "approx_bytes": int(per_session * len(self._sessions)),
+            "approx_bytes_per_session": int(per_session),
+        }
+
+
+def _session_size(session) -> int:
+    size = sys.getsizeof(session)
+    context = session.context
+    size += sys.getsizeof(context)
+    size += sys.getsizeof(getattr(context, "summary", ""))
+    for turn in getattr(context, "turns", []):
+        size += sys.getsizeof(turn) + sys.getsizeof(turn["content"])
+    return size
+
+
+def log_stats(store):
+    stats = store.stats()
+    logging.info(
+        f"[SessionStore] 📊 Сессий: {stats['sessions']} {stats['by_mode']}, "
+        f"~{stats['approx_bytes'] / 1024:.0f} КБ"
+    )
@@ -0,0 +1,160 @@
+import os
+import json
+import html
+import time
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import MessageNotModified, TelegramAPIError
+
+from metrics import timed, stage_latency, record_usage
+from outbox import outbox, TG_MESSAGE_LIMIT
+
+# ⚙️ Настройки стриминга
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # не чаще раза в секунду на чат
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "20"))  # не показываем совсем короткие обрывки
+
+
+# 📡 Чтение SSE-потока OpenRouter: отдаёт кусочки content по мере прихода
+async def stream_chat_completion(client, url, payload, headers):
+    payload = dict(payload, stream=True)
+    async with client.stream("POST", url, json=payload, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            # Пустые строки разделяют события, строки с ':' — служебные комментарии
+            if not line or line.startswith(":") or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                logging.debug(f"[stream_chat_completion] Пропущен битый чанк: {data[:100]}")
+                continue
+            if chunk.get("usage"):
+                record_usage(chunk.get("model") or payload.get("model"), chunk["usage"])
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+
+# 🔍 Достаём уже пришедшую часть поля "reply" из недописанного JSON
+def partial_reply(buffer: str) -> str:
+    key = buffer.find('"reply"')
+    if key == -1:
+        return ""
+    colon = buffer.find(":", key + 7)
+    if colon == -1:
+        return ""
+    quote = buffer.find('"', colon + 1)
+    if quote == -1 or buffer[colon + 1:quote].strip():
+        return ""
+
+    chars = []
+    i = quote + 1
+    while i < len(buffer):
+        ch = buffer[i]
+        if ch == '"':
+            break
+        if ch == "\\":
+            if i + 1 >= len(buffer):
+                break  # экранирование ещё не дошло целиком
+            nxt = buffer[i + 1]
+            if nxt == "u":
+                if i + 6 > len(buffer):
+                    break
+                try:
+                    chars.append(chr(int(buffer[i + 2:i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            chars.append({"n": "\n", "t": "\t", "r": ""}.get(nxt, nxt))
+            i += 2
+            continue
+        chars.append(ch)
+        i += 1
+    return "".join(chars)
+
+
+# ✍️ Одно сообщение в Telegram, которое редактируется по мере генерации ответа
+class ProgressiveReply:
+    def __init__(self, message, interval=STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.sent = None
+        self.shown = ""
+        self.last_edit = 0.0
+        self.started = time.monotonic()
+        self.ttft = None
+        self._pending = None  # не больше одной правки в очереди outbox
+
+    # Колбэк для analyze_message: получает весь накопленный текст.
+    # Правка уходит в фоне: пока Telegram и лимиты outbox её держат, стрим модели читается дальше
+    async def update(self, buffer: str):
+        if self._pending is not None and not self._pending.done():
+            return  # предыдущая правка ещё не ушла — эту пропускаем, покажем более свежий текст позже
+        visible = partial_reply(buffer).strip()
+        if len(visible) < STREAM_MIN_CHARS or visible == self.shown:
+            return
+        now = time.monotonic()
+        if self.sent is not None and now - self.last_edit < self.interval:
+            return
+        text = html.escape(visible[:TG_MESSAGE_LIMIT - 2]) + " ▌"  # длинный ответ целиком придёт в finalize
+        self.shown = visible
+        self._pending = asyncio.create_task(self._show(text, now))
+
+    async def _show(self, text, now):
+        try:
+            if self.sent is None:
+                self.sent = await outbox.answer(self.message, text)
+                self.ttft = now - self.started
+                stage_latency.observe(self.ttft, "first_visible_text")
+                logging.info(f"[ProgressiveReply] ⏱ Первый текст через {self.ttft:.2f} с")
+            else:
+                sent = self.sent
+                await outbox.call(self.message.chat.id, lambda: sent.edit_text(text))
+        except MessageNotModified:
+            pass
+        except TelegramAPIError as e:
+            logging.warning(f"[ProgressiveReply] ⚠️ Не удалось обновить сообщение: {e}")
+        self.last_edit = time.monotonic()
+
+    # Финал и удаление — только после ушедшей правки, иначе она легла бы поверх
+    async def _settle(self):
+        if self._pending is not None and not self._pending.done():
+            await asyncio.wait([self._pending])
+
+    # Ответ устарел (пришло новое сообщение) — убираем недописанное
+    async def discard(self):
+        await self._settle()
+        if self.sent is None:
+            return
+        try:
+            await outbox.call(self.message.chat.id, self.sent.delete)
+        except TelegramAPIError as e:
+            logging.warning(f"[ProgressiveReply] ⚠️ Не удалось удалить сообщение: {e}")
+        self.sent = None
+
+    # Финальный текст: правим уже показанное сообщение или отправляем новое
+    async def finalize(self, text, **kwargs):
+        with timed("telegram_send"):
+            return await self._finalize(text, **kwargs)
+
+    async def _finalize(self, text, **kwargs):
+        await self._settle()
+        if self.sent is not None and len(text) > TG_MESSAGE_LIMIT:
+            await self.discard()  # в одно сообщение не влезет — отправляем частями заново
+        if self.sent is None:
+            return await outbox.answer(self.message, text, **kwargs)
+        try:
+            sent = self.sent
+            return await outbox.call(self.message.chat.id, lambda: sent.edit_text(text, **kwargs))
+        except MessageNotModified:
+            return self.sent
+        except TelegramAPIError as e:
+            logging.warning(f"[ProgressiveReply] ⚠️ Не удалось отредактировать, отправляем заново: {e}")
+            return await outbox.answer(self.message, text, **kwargs)
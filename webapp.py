@@ -0,0 +1,93 @@
+import os
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+import metrics
+
+# ⚙️ Приём обновлений: webhook на проде, polling для локальной разработки
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")  # например https://tools-bot.onrender.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_HOST else "polling")
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))  # одновременно обрабатываемых апдейтов
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "5000"))
+
+
+# 📬 Обработка апдейтов в фоне с ограничением параллельности
+class UpdateProcessor:
+    def __init__(self, dp: Dispatcher, concurrency=UPDATE_CONCURRENCY):
+        self.dp = dp
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = set()
+        self.stats = {"received": 0, "processed": 0, "failed": 0}
+
+    def submit(self, update: types.Update):
+        self.stats["received"] += 1
+        task = asyncio.create_task(self._process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _process(self, update):
+        async with self.semaphore:
+            # Хэндлеры aiogram берут бота и диспетчер из контекста
+            Bot.set_current(self.dp.bot)
+            Dispatcher.set_current(self.dp)
+            try:
+                await self.dp.process_update(update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error(f"[UpdateProcessor] ❌ Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+
+    # Дожидаемся начатых апдейтов при остановке
+    async def drain(self, timeout=10):
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+
+
+# 🌐 Главная страница (health-check для Render)
+async def index(request: web.Request):
+    return web.Response(text="ToolBot работает!")
+
+
+# 📈 Метрики в формате Prometheus: всё считается только в момент опроса
+async def metrics_endpoint(request: web.Request):
+    return web.Response(
+        body=metrics.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+# 📨 Telegram присылает апдейт — отвечаем сразу, обрабатываем в фоне
+async def telegram_webhook(request: web.Request):
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    try:
+        update = types.Update(**(await request.json()))
+    except Exception as e:
+        logging.warning(f"[telegram_webhook] ⚠️ Некорректный апдейт: {e}")
+        return web.Response(status=400)
+    request.app["updates"].submit(update)
+    return web.Response(text="ok")
+
+
+def create_web_app(processor: UpdateProcessor) -> web.Application:
+    app = web.Application()
+    app["updates"] = processor
+    app.router.add_get("/", index)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    return app
+
+
+async def start_web_app(app: web.Application, host=WEB_HOST, port=WEB_PORT) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"[webapp] 🌐 Веб-сервер слушает {host}:{port} (режим {BOT_MODE})")
+    return runner
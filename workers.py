@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import queue
+import bisect
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import multiprocessing
+from collections import deque
+
+from aiogram import types
+
+import metrics
+from outbox import TG_GLOBAL_RATE, TG_GLOBAL_BURST
+from llm_scheduler import LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE
+from webapp import UPDATE_CONCURRENCY
+
+# ⚙️ Несколько процессов-воркеров за одним приёмником апдейтов
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))  # 1 — всё в одном процессе, как раньше
+WORKER_DB_PATH = os.getenv("WORKER_DB_PATH", "workers.db")  # общий файл: пульс воркеров
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "2"))
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", "10"))  # без пульса дольше — воркер выбывает из кольца
+WORKER_HANDOFF_TIMEOUT = float(os.getenv("WORKER_HANDOFF_TIMEOUT", "3"))  # ждём, пока старый владелец отдаст сессии
+WORKER_RING_REPLICAS = int(os.getenv("WORKER_RING_REPLICAS", "64"))  # виртуальных узлов на воркер
+ROUTER_BUFFER = int(os.getenv("ROUTER_BUFFER", "10000"))  # апдейтов, пока кольцо перестраивается
+
+
+def _hash(key) -> int:
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+
+# 💍 Согласованное хэширование: при уходе воркера переезжают только его пользователи
+class HashRing:
+    def __init__(self, nodes=(), replicas=WORKER_RING_REPLICAS):
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[index]
+
+
+# Лимиты на весь бот делятся между воркерами: дочерний процесс читает их из окружения при импорте
+def worker_limits(count) -> dict:
+    return {
+        "TG_GLOBAL_RATE": str(TG_GLOBAL_RATE / count),
+        "TG_GLOBAL_BURST": str(max(1, TG_GLOBAL_BURST // count)),
+        "LLM_MAX_CONCURRENCY": str(max(1, LLM_MAX_CONCURRENCY // count)),
+        "LLM_MAX_QUEUE": str(max(1, LLM_MAX_QUEUE // count)),
+        "UPDATE_CONCURRENCY": str(max(1, UPDATE_CONCURRENCY // count)),
+    }
+
+
+# Пользователь, которому принадлежит апдейт: его сессия и порядок сообщений живут на одном воркере
+def update_user_id(data: dict):
+    for kind in ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+                 "my_chat_member", "chat_member", "chat_join_request", "pre_checkout_query", "shipping_query"):
+        item = data.get(kind)
+        if item:
+            user = item.get("from") or (item.get("chat") or {})
+            if user.get("id") is not None:
+                return user["id"]
+    return data.get("update_id", 0)
+
+
+# 🩺 Общий локальный реестр воркеров (SQLite): пульс, число обработанных апдейтов и снимок метрик
+class WorkerRegistry:
+    def __init__(self, path=WORKER_DB_PATH):
+        self.path = path
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "worker_id INTEGER PRIMARY KEY, pid INTEGER, started_at REAL, heartbeat REAL, handled INTEGER)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS worker_metrics (worker_id INTEGER PRIMARY KEY, metrics TEXT)")
+        return self._conn
+
+    def heartbeat(self, worker_id, pid, started_at, handled, snapshot=None):
+        with self._db() as conn:
+            conn.execute(
+                "INSERT INTO workers (worker_id, pid, started_at, heartbeat, handled) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET pid = excluded.pid, started_at = excluded.started_at, "
+                "heartbeat = excluded.heartbeat, handled = excluded.handled",
+                (worker_id, pid, started_at, time.time(), handled),
+            )
+            if snapshot is not None:
+                conn.execute("INSERT OR REPLACE INTO worker_metrics (worker_id, metrics) VALUES (?, ?)",
+                             (worker_id, snapshot))
+
+    def remove(self, worker_id):
+        with self._db() as conn:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            conn.execute("DELETE FROM worker_metrics WHERE worker_id = ?", (worker_id,))
+
+    def alive(self, timeout=WORKER_TIMEOUT) -> dict:
+        rows = self._db().execute("SELECT worker_id, pid FROM workers WHERE heartbeat > ?",
+                                  (time.time() - timeout,)).fetchall()
+        return dict(rows)
+
+    # Последние снимки метрик живых воркеров: {worker_id: metrics.export()}
+    def metrics(self, timeout=WORKER_TIMEOUT) -> dict:
+        rows = self._db().execute(
+            "SELECT m.worker_id, m.metrics FROM worker_metrics m JOIN workers w ON w.worker_id = m.worker_id "
+            "WHERE w.heartbeat > ?", (time.time() - timeout,)).fetchall()
+        return {worker_id: json.loads(snapshot) for worker_id, snapshot in rows}
+
+    def clear(self):
+        with self._db() as conn:
+            conn.execute("DELETE FROM workers")
+            conn.execute("DELETE FROM worker_metrics")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# 🔀 Приёмник: раскладывает апдейты по воркерам и перестраивает кольцо, когда воркеры приходят и уходят
+class Router:
+    def __init__(self, target, count=BOT_WORKERS, registry=None):
+        self.target = target  # target(worker_id, inbox, control) — точка входа процесса-воркера
+        self.count = count
+        self.registry = registry or WorkerRegistry()
+        self.ctx = multiprocessing.get_context("spawn")
+        self.control = self.ctx.Queue()  # ответы воркеров: ("released", worker_id, epoch)
+        self.limits = worker_limits(count)
+        self.inboxes = {}
+        self.processes = {}
+        self.ring = HashRing()
+        self.epoch = 0
+        self.buffer = deque()
+        self.worker_metrics = {}  # снимки из реестра, обновляются с пульсом
+        self.rebalancing = False
+        self._acks = {}
+        self._tasks = []
+        self._stopping = False
+        self.stats = {"forwarded": 0, "buffered": 0, "dropped": 0, "rebalances": 0, "restarts": 0}
+
+    async def start(self):
+        await self._registry(self.registry.clear)
+        for worker_id in range(self.count):
+            self._spawn(worker_id)
+        self._tasks = [asyncio.create_task(self._read_control()), asyncio.create_task(self._monitor())]
+        logging.info(f"[Router] 🔀 Запущено воркеров: {self.count}")
+
+    async def _registry(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _spawn(self, worker_id):
+        os.environ.update(self.limits)  # окружение наследует новый процесс; в приёмнике лимиты уже прочитаны
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(target=self.target, args=(worker_id, inbox, self.control),
+                                   name=f"toolbot-worker-{worker_id}", daemon=True)
+        process.start()
+        self.inboxes[worker_id] = inbox
+        self.processes[worker_id] = process
+
+    # Совместимость с UpdateProcessor: webhook и polling отдают сюда types.Update
+    def submit(self, update: types.Update):
+        self.forward(update.to_python())
+
+    def forward(self, data: dict):
+        if self.rebalancing or not self.ring.nodes:
+            if len(self.buffer) >= ROUTER_BUFFER:
+                self.buffer.popleft()
+                self.stats["dropped"] += 1
+            self.buffer.append(data)
+            self.stats["buffered"] += 1
+            return
+        worker_id = self.ring.node(update_user_id(data))
+        self.inboxes[worker_id].put_nowait(("update", data))  # сериализация — в фоновом потоке очереди
+        self.stats["forwarded"] += 1
+
+    # 🩺 Пульс из реестра + живость процессов → состав кольца
+    async def _monitor(self):
+        while not self._stopping:
+            await asyncio.sleep(WORKER_HEARTBEAT)
+            alive = await self._registry(self.registry.alive, WORKER_TIMEOUT)
+            self.worker_metrics = await self._registry(self.registry.metrics, WORKER_TIMEOUT)
+            members = set()
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logging.warning(f"[Router] 💥 Воркер {worker_id} завершился (код {process.exitcode}), перезапускаем")
+                    await self._registry(self.registry.remove, worker_id)
+                    self.stats["restarts"] += 1
+                    self._spawn(worker_id)
+                elif alive.get(worker_id) == process.pid:
+                    members.add(worker_id)
+            if members != self.ring.nodes:
+                await self.rebalance(members)
+
+    async def rebalance(self, members):
+        previous = self.ring.nodes
+        self.epoch += 1
+        epoch = self.epoch
+        self.ring = HashRing(members)
+        self.stats["rebalances"] += 1
+        logging.info(f"[Router] 💍 Кольцо #{epoch}: воркеры {sorted(members)} (было {sorted(previous)})")
+
+        # Старые владельцы выгружают чужие сессии на диск; новые апдейты пока ждут в буфере
+        self.rebalancing = True
+        waiting = set(previous & members)
+        done = self._acks[epoch] = (set(), asyncio.Event())
+        for worker_id in members:
+            self.inboxes[worker_id].put_nowait(("ring", epoch, sorted(members)))
+        try:
+            await asyncio.wait_for(self._wait_acks(done, waiting), timeout=WORKER_HANDOFF_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"[Router] ⏳ Не дождались передачи сессий от {sorted(waiting - done[0])}")
+        self._acks.pop(epoch, None)
+        self.rebalancing = False
+
+        buffered, self.buffer = self.buffer, deque()
+        for data in buffered:
+            self.forward(data)
+
+    async def _wait_acks(self, done, waiting):
+        acked, event = done
+        while not waiting <= acked:
+            await event.wait()
+            event.clear()
+
+    async def _read_control(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.control.get)
+            if message is None:
+                return
+            kind, worker_id, epoch = message
+            if kind == "released" and epoch in self._acks:
+                acked, event = self._acks[epoch]
+                acked.add(worker_id)
+                event.set()
+
+    # 📥 Polling без диспетчера: апдейты только раскладываются по воркерам
+    async def poll(self, bot, timeout=20):
+        offset = None
+        while True:
+            try:
+                batch = await bot.get_updates(offset=offset, timeout=timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"[Router] ⚠️ Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in batch:
+                offset = update.update_id + 1
+                self.submit(update)
+
+    async def stop(self, timeout=15):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        for inbox in self.inboxes.values():
+            inbox.put_nowait(("stop",))
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            await loop.run_in_executor(None, process.join, max(0.1, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self.control.put_nowait(None)
+        await self._registry(self.registry.clear)
+        self.registry.close()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "workers": sorted(self.ring.nodes), "epoch": self.epoch, "buffer": len(self.buffer)}
+
+
+# 🧵 Сторона воркера: очередь апдейтов от приёмника, пульс, передача сессий
+class WorkerLink:
+    def __init__(self, worker_id, inbox, control, registry=None):
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.control = control
+        self.registry = registry or WorkerRegistry()
+        self.parent = os.getppid()
+        self.started_at = time.time()
+        self.handled = 0
+
+    # submit(data) — обработать апдейт; release(keep) — выгрузить сессии, для которых keep(user_id) ложно
+    async def run(self, submit, release):
+        loop = asyncio.get_running_loop()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, self._take)
+                for message in batch:
+                    kind = message[0]
+                    if kind == "update":
+                        self.handled += 1
+                        submit(message[1])
+                    elif kind == "ring":
+                        _, epoch, members = message
+                        ring = HashRing(members)
+                        released = await release(lambda user_id: ring.node(user_id) == self.worker_id)
+                        if released:
+                            logging.info(f"[WorkerLink] 🔀 Воркер {self.worker_id} передал {len(released)} сессий")
+                        self.control.put_nowait(("released", self.worker_id, epoch))
+                    elif kind == "stop":
+                        return
+        finally:
+            heartbeat.cancel()
+            await loop.run_in_executor(None, self.registry.remove, self.worker_id)
+            self.registry.close()
+
+    # Забираем всё, что накопилось, одной пачкой; приёмник умер — завершаемся
+    def _take(self):
+        while True:
+            try:
+                batch = [self.inbox.get(timeout=WORKER_HEARTBEAT)]
+                break
+            except queue.Empty:
+                if os.getppid() != self.parent:
+                    return [("stop",)]
+        try:
+            while len(batch) < 256:
+                batch.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        pid = os.getpid()
+        while True:
+            snapshot = json.dumps(metrics.export(), ensure_ascii=False)  # в event loop: stats читаются без гонок
+            try:
+                await loop.run_in_executor(None, self.registry.heartbeat, self.worker_id, pid, self.started_at,
+                                           self.handled, snapshot)
+            except sqlite3.Error as e:
+                logging.warning(f"[WorkerLink] ⚠️ Не удалось записать пульс: {e}")
+            await asyncio.sleep(WORKER_HEARTBEAT)